@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+#
+# adaptive.py
+#
+# Adaptive sweeps over a continuous rule parameter: a coarse grid is refined
+# only where the strategy or the advantage changes faster than a tolerance,
+# and every strategy cell is described piecewise by its decision boundaries
+#
+# A decision boundary is where the EVs of the two actions a cell switches
+# between cross. Between two samples the crossing is found by interpolating
+# the difference of the two EVs, so an interval only needs refining while
+# that interpolation (or the advantage) is not accurate enough, not until
+# the interval is as short as the tolerance.
+#
+
+import time
+
+import easybj
+import packing
+from easybj import DEALER_CODE, PLAYER_CODE, make_rules
+
+# continuous parameters: a function from the parameter to the rules
+PARAMETERS = {
+    # payout of a player blackjack
+    'blackjack' : lambda t: { 'blackjack' : t },
+    # net result of surrendering
+    'surrender_value' : lambda t: { 'surrender_value' : t },
+    # weight of the ten-valued cards (4 in a full deck, every other card
+    # value weighing 1)
+    'tens' : lambda t: { 'cards' : [1]*9 + [t] },
+}
+
+# index of the EV of each action letter in Sample.values
+ACTION_INDEX = { 'S':0, 'H':1, 'D':2, 'P':3, 'R':4 }
+
+#
+# One sample of the sweep: the advantage, the packed strategy and the EV of
+# every action of every strategy cell at t
+#
+class Sample:
+    def __init__(self, t, results, rules):
+        self.t = t
+        self.advantage = results['advantage']
+        self.strategy = packing.pack(results['strategy'])
+        rules = make_rules(rules)
+        surrender = rules['surrender_value'] if rules['surrender'] else float('-inf')
+        stand, hit, double, split = (results[name] for name in ('stand', 'hit', 'double', 'split'))
+        self.values = []
+        for pc in PLAYER_CODE:
+            # pairs not split are played as their total
+            total = pc
+            if pc in easybj.SPLIT_CODE and pc != 'AA':
+                total = str(2*easybj.POINT_MAP[pc[0]])
+            for dc in DEALER_CODE:
+                s = split[pc,dc] if pc in easybj.SPLIT_CODE else None
+                self.values.append((stand[total,dc], hit[total,dc], double[total,dc],
+                    float('-inf') if s is None else s, surrender))
+
+    # action of strategy cell i
+    def action(self, i):
+        return packing.ACTIONS[self.strategy[i >> 1] >> 4*(i & 1) & 15]
+
+    #
+    # How much better action b is than action a in cell i (a cell switching
+    # from a to b crosses zero at the boundary)
+    #
+    def margin(self, i, a, b):
+        values = self.values[i]
+        if a[0] == b[0]:
+            # same action, the best of standing and hitting changes
+            m = values[1] - values[0]
+            return m if b[1] == 'h' else -m
+        return values[ACTION_INDEX[b[0]]] - values[ACTION_INDEX[a[0]]]
+
+# root of the line through (t0, m0) and (t1, m1)
+def crossing(t0, m0, t1, m1):
+    if m1 == m0:
+        return (t0 + t1)/2
+    return t0 + (t1 - t0)*(-m0)/(m1 - m0)
+
+#
+# Returns { (cell, start of the samples bracketing it): boundary } for the
+# cells that change between samples a and b, using the middle sample when
+# given, or None when the interval has to be split (a cell changes more than
+# once, or the boundary estimates from the ends and from the middle differ
+# by more than xtol)
+#
+def locate(a, b, mid=None, xtol=0.):
+    found = {}
+    changed = packing.diff_cells(a.strategy, b.strategy)
+    if mid is not None:
+        # a cell that changes and changes back within the interval
+        for i in set(packing.diff_cells(a.strategy, mid.strategy)) - set(changed):
+            return None
+    for i in changed:
+        act_a, act_b = a.action(i), b.action(i)
+        ma, mb = a.margin(i, act_a, act_b), b.margin(i, act_a, act_b)
+        estimate = crossing(a.t, ma, b.t, mb)
+        if mid is None:
+            found[i,a.t] = estimate
+            continue
+        act_mid = mid.action(i)
+        if act_mid not in (act_a, act_b):
+            return None
+        # the half of the interval where the cell changes
+        mm = mid.margin(i, act_a, act_b)
+        if act_mid == act_a:
+            start, refined = mid.t, crossing(mid.t, mm, b.t, mb)
+        else:
+            start, refined = a.t, crossing(a.t, ma, mid.t, mm)
+        if abs(refined - estimate) > xtol:
+            return None
+        found[i,start] = refined
+    return found
+
+#
+# Sweeps a parameter over [lo, hi] and returns a dictionary of:
+#
+#   samples: the samples by parameter value
+#   cells: { (player label, dealer label): [(start, end, action)] }
+#   calculations: number of calls to easybj.calculate()
+#
+# parameter: a key of PARAMETERS or a function from the parameter to rules
+# rules: rules the parameter's rules override
+# coarse: number of points of the starting grid
+# xtol: accuracy of the boundaries (no interval is split below it)
+# tol: accuracy of the advantage interpolated linearly between samples
+#
+def sweep(parameter, lo, hi, rules=None, coarse=9, xtol=1e-4, tol=1e-5):
+    to_rules = PARAMETERS[parameter] if isinstance(parameter, str) else parameter
+    base = dict(rules or {})
+
+    def sample(t):
+        t_rules = dict(base, **to_rules(t))
+        return Sample(t, easybj.calculate(rules=t_rules), t_rules)
+
+    step = (hi - lo)/(coarse - 1)
+    samples = [ sample(lo + i*step) for i in range(coarse) ]
+    calculations = coarse
+
+    # boundaries found in each accepted interval, by cell and interval start
+    found = {}
+    todo = list(zip(samples, samples[1:]))
+    while todo:
+        a, b = todo.pop()
+        if b.t - a.t <= xtol:
+            found.update(locate(a, b))
+            continue
+        mid = sample((a.t + b.t)/2)
+        calculations += 1
+        samples.append(mid)
+        bent = abs(mid.advantage - (a.advantage + b.advantage)/2) > tol
+        cells = None if bent else locate(a, b, mid, xtol)
+        if cells is None:
+            todo += [ (a, mid), (mid, b) ]
+        else:
+            found.update(cells)
+
+    samples.sort(key=lambda s: s.t)
+    return {
+        'samples' : samples,
+        'cells' : pieces(samples, found),
+        'calculations' : calculations,
+    }
+
+#
+# Returns the piecewise description of every strategy cell from the samples
+# and the boundaries found between them
+#
+def pieces(samples, found):
+    n = len(DEALER_CODE)
+    cells = {}
+    for i in range(len(PLAYER_CODE)*n):
+        key = (PLAYER_CODE[i // n], DEALER_CODE[i % n])
+        start, action = samples[0].t, samples[0].action(i)
+        cells[key] = []
+        for a, b in zip(samples, samples[1:]):
+            if b.action(i) != a.action(i):
+                t = found[i,a.t] if (i, a.t) in found else (a.t + b.t)/2
+                # a boundary found over a longer interval is clamped to the
+                # samples that bracket it
+                t = min(max(t, a.t), b.t)
+                cells[key].append((start, t, action))
+                start, action = t, b.action(i)
+        cells[key].append((start, samples[-1].t, action))
+    return cells
+
+#
+# Returns the advantage at t interpolated linearly between the samples
+#
+def interpolate(samples, t):
+    for a, b in zip(samples, samples[1:]):
+        if a.t <= t <= b.t:
+            w = (t - a.t)/(b.t - a.t)
+            return a.advantage + w*(b.advantage - a.advantage)
+    raise ValueError("%g is outside the sweep"%t)
+
+#
+# Returns the cells whose action changes across the sweep with their pieces
+#
+def changing_cells(result):
+    return { key:cell for key, cell in result['cells'].items() if len(cell) > 1 }
+
+#
+# Compares an adaptive sweep with a dense grid of the given number of points
+# (boundaries of the dense grid are halfway between its points)
+#
+def compare(parameter, lo, hi, points=2001, **options):
+    h = (hi - lo)/(points - 1)
+    start = time.perf_counter()
+    result = sweep(parameter, lo, hi, xtol=h/2, **options)
+    elapsed = time.perf_counter() - start
+    to_rules = PARAMETERS[parameter]
+    dense = [ Sample(lo + i*h, easybj.calculate(rules=to_rules(lo + i*h)), to_rules(lo + i*h))
+        for i in range(points) ]
+    dense_cells = pieces(dense, {})
+    # largest distance between matching boundaries (None when the pieces differ)
+    error = 0.
+    for key, cell in result['cells'].items():
+        other = dense_cells[key]
+        if [ p[2] for p in cell ] != [ p[2] for p in other ]:
+            error = None
+            break
+        for p, q in zip(cell, other):
+            error = max(error, abs(p[1] - q[1]))
+    adv_error = max(abs(interpolate(result['samples'], s.t) - s.advantage) for s in dense)
+    print("%s: %d calculations (dense grid %d, %.0fx fewer) in %.2fs"%(
+        parameter, result['calculations'], points, points/result['calculations'], elapsed))
+    print("  %d changing cells, largest boundary difference %s (grid step %.1e), advantage error %.2e"%(
+        len(changing_cells(result)), "mismatch" if error is None else "%.2e"%error, h, adv_error))
+
+if __name__ == "__main__":
+    compare('blackjack', 1., 2.)
+    compare('surrender_value', -1., 0.)
+    compare('tens', 3., 5.)
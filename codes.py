@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+#
+# codes.py
+#
+# Integer enumeration of hand codes (hard, soft, pair, 21, BJ and bust) and
+# the arithmetic needed to play hands out on them. String codes such as
+# '16', 'A7' or '88' only appear at the Table label boundary.
+#
+
+# a busted hand (its score is zero)
+BUST = 0
+
+# hard hands use their point value as code (4 to 20, plus 21)
+TWENTY_ONE = 21
+
+# natural blackjack
+BJ = 22
+
+# soft hands AA (12) to A9 (20) are SOFT_BASE + points
+SOFT_BASE = 11
+
+# pairs 22 to TT are PAIR_BASE + card value ('AA' is the soft code 12)
+PAIR_BASE = 30
+
+# a lone ace (soft 11), the start of a split ace hand
+ACE = 41
+
+# number of integer codes
+NUM_CODES = 42
+
+# number of distinct card values (ace is 1, ten is 10)
+NUM_CARDS = 10
+
+# index of each dealer final score in a dealer distribution
+FINAL = { 0:0, 17:1, 18:2, 19:3, 20:4, 21:5 }
+
+# dealer final scores in distribution order
+FINAL_SCORES = [ 0, 17, 18, 19, 20, 21 ]
+
+# code of a hand from its point value and softness
+def hand(points, soft=False):
+    if points > 21:
+        return BUST
+    if points == 21:
+        return TWENTY_ONE
+    if soft:
+        return ACE if points == 11 else SOFT_BASE + points
+    return points
+
+# code of a soft hand
+def soft(points):
+    return SOFT_BASE + points
+
+# code of a pair of card value
+def pair(value):
+    return SOFT_BASE + 12 if value == 1 else PAIR_BASE + value
+
+# whether the code is a soft hand
+def is_soft(code):
+    return SOFT_BASE + 12 <= code <= SOFT_BASE + 20 or code == ACE
+
+# whether the code is a pair
+def is_pair(code):
+    return code == SOFT_BASE + 12 or PAIR_BASE + 2 <= code <= PAIR_BASE + 10
+
+# card value of a pair
+def pair_card(code):
+    return 1 if code == SOFT_BASE + 12 else code - PAIR_BASE
+
+# point value of a hand (a pair counts as its total)
+def points(code):
+    if code == BJ:
+        return 21
+    if code < BJ:
+        return code
+    if code == ACE:
+        return 11
+    if is_soft(code):
+        return code - SOFT_BASE
+    return 2*(code - PAIR_BASE)
+
+# score of a hand when standing (zero if busted)
+def score(code):
+    return points(code)
+
+# code of a hand after adding a card (a pair is played as its total)
+def add_card(code, card):
+    if code == BUST:
+        return BUST
+    total = points(code)
+    soft_hand = is_soft(code)
+    if card == 1:
+        if soft_hand:
+            total += 1
+        else:
+            total += 11
+            soft_hand = True
+    else:
+        total += card
+    if total > 21 and soft_hand:
+        total -= 10
+        soft_hand = False
+    return hand(total, soft_hand)
+
+# code of a hand of one card
+def one_card(card):
+    return hand(11, True) if card == 1 else hand(card)
+
+# code of a player's two-card hand (pairs and blackjack included)
+def two_cards(a, b):
+    if a == b:
+        return pair(a)
+    if a + b == 11 and (a == 1 or b == 1):
+        return BJ
+    return add_card(hand(11, True) if a == 1 else a, b)
+
+# the dealer treats soft 18 or above as hard
+def dealer(code):
+    if is_soft(code) and points(code) >= 18:
+        return hand(points(code))
+    if is_pair(code):
+        return add_card(one_card(pair_card(code)), pair_card(code))
+    return code
+
+# code of a dealer's two-card hand (blackjack included)
+def dealer_two_cards(a, b):
+    if a + b == 11 and (a == 1 or b == 1):
+        return BJ
+    return dealer(add_card(one_card(a), b))
+
+# whether the dealer stands on the code
+def dealer_stands(code):
+    return code == BUST or (not is_soft(code) and points(code) >= 17)
+
+# string label of each code (the Table boundary)
+LABELS = [ str(c) for c in range(BJ) ] + [ 'BJ' ] + \
+    [ 'AA' ] + [ 'A%d'%(p - 11) for p in range(13, 21) ] + \
+    [ '%d%d'%(v, v) for v in range(2, 10) ] + [ 'TT', 'A' ]
+
+# code of each string label ('AA' is the soft code)
+CODE = { label:c for c, label in enumerate(LABELS) }
+
+# codes of a sequence of labels
+def codes(labels):
+    return [ CODE[label] for label in labels ]
+
+# player transitions: NEXT[code][card-1] is the code after drawing card
+NEXT = [ [ add_card(c, card) for card in range(1, NUM_CARDS + 1) ]
+    for c in range(NUM_CODES) ]
+
+# dealer transitions (soft 18 or above becomes hard)
+DEALER_NEXT = [ [ dealer(add_card(c, card)) for card in range(1, NUM_CARDS + 1) ]
+    for c in range(NUM_CODES) ]
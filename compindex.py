@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+#
+# compindex.py
+#
+# Precomputed index of the depleted compositions of a single deck: for each
+# composition reachable by dealing up to a number of cards, the dealer's
+# final score distributions and the stand, hit, double and split EV tables,
+# stored in a memory-mapped file
+#
+# A composition is identified by the cards removed from the full deck. The
+# removed cards are ranked among all the removals of at most depth cards
+# (first by number of cards, then lexicographically), which is a minimal
+# perfect hash: every composition has its own record number and there is no
+# gap, so a lookup is a rank, a multiplication and a read from the map.
+#
+# Each record is calculated with the composition as the card weights of the
+# round (see the 'cards' rule): cards dealt during the round are not
+# removed.
+#
+# The file is built by a pool of processes and can be resumed: each record
+# has a flag set once it is written, and building again only calculates the
+# records whose flag is not set.
+#
+
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from multiprocessing import Pool
+
+import easybj
+from codes import FINAL_SCORES
+from easybj import DEALER_CODE, make_rules
+from table import Table
+
+# magic number and header length at the start of an index file
+HEADER = struct.Struct("<4sI")
+MAGIC = b"EBJC"
+
+# cards of each value in a single deck, in DISTINCT order
+DECK = [4]*9 + [16]
+
+# dealer final scores as result labels
+FINAL_LABELS = [ str(d) for d in FINAL_SCORES ]
+
+# EV tables stored in each record, after the dealer distributions
+TABLES = [ 'stand', 'hit', 'double', 'split' ]
+
+#
+# Returns ways[i][n]: the number of ways to remove n cards of the values i
+# onwards from a deck (ways[len(deck)][0] is 1)
+#
+def removal_counts(deck, depth):
+    ways = [ [0]*(depth + 1) for _ in range(len(deck) + 1) ]
+    ways[len(deck)][0] = 1
+    for i in reversed(range(len(deck))):
+        for n in range(depth + 1):
+            ways[i][n] = sum(ways[i+1][n-r] for r in range(min(deck[i], n) + 1))
+    return ways
+
+#
+# Ranks the removals of at most depth cards from a deck: rank() and
+# unrank() map a removal (cards removed of each value) to its record number
+# and back
+#
+class Ranking:
+    def __init__(self, deck=DECK, depth=6):
+        self.deck = list(deck)
+        self.depth = depth
+        self.ways = removal_counts(self.deck, depth)
+        # first rank of the removals of each number of cards
+        self.offsets = [0]
+        for n in range(depth + 1):
+            self.offsets.append(self.offsets[-1] + self.ways[0][n])
+
+    # number of removals
+    def __len__(self):
+        return self.offsets[-1]
+
+    def rank(self, removed):
+        n = sum(removed)
+        if n > self.depth or any(not 0 <= r <= c for r, c in zip(removed, self.deck)):
+            raise KeyError("composition outside the index")
+        rank = self.offsets[n]
+        for i, r in enumerate(removed):
+            # removals taking fewer cards of value i come first
+            for fewer in range(r):
+                rank += self.ways[i+1][n - fewer]
+            n -= r
+        return rank
+
+    def unrank(self, rank):
+        if not 0 <= rank < len(self):
+            raise IndexError("rank out of range")
+        n = 0
+        while self.offsets[n+1] <= rank:
+            n += 1
+        rank -= self.offsets[n]
+        removed = []
+        for i in range(len(self.deck)):
+            r = 0
+            while rank >= self.ways[i+1][n - r]:
+                rank -= self.ways[i+1][n - r]
+                r += 1
+            removed.append(r)
+            n -= r
+        return removed
+
+#
+# Returns [(name, ylabels, xlabels)] of the blocks of a record: the dealer
+# distributions by dealer code, then the EV tables
+#
+def record_layout(results):
+    layout = [ ('dealer', list(DEALER_CODE), FINAL_LABELS) ]
+    for name in TABLES:
+        table = results[name]
+        layout.append((name, list(table.ylabels), list(table.xlabels)))
+    return layout
+
+#
+# Returns the cells of a record (NaN for empty cells) in the layout's order
+#
+def record_values(results, layout):
+    values = array('d')
+    for name, ylabels, xlabels in layout:
+        if name == 'dealer':
+            for dc in ylabels:
+                dist = results['dealer'][dc]
+                values.extend(dist.get(d, 0.) for d in xlabels)
+            continue
+        rows = results[name].tabledict
+        for y in ylabels:
+            values.extend(math.nan if rows[y][x] is None else rows[y][x] for x in xlabels)
+    return values
+
+#
+# Offsets of the record flags and of the records of a file with a header of
+# the given length
+#
+def _layout(header_size, count):
+    flags = HEADER.size + header_size
+    records = (flags + count + 7)//8*8
+    return flags, records
+
+#
+# Calculates the records of a list of ranks and returns [(rank, bytes)]
+#
+# task: (rules, deck, depth, layout, ranks)
+#
+def build_records(task):
+    rules, deck, depth, layout, ranks = task
+    ranking = Ranking(deck, depth)
+    records = []
+    for rank in ranks:
+        removed = ranking.unrank(rank)
+        cards = [ c - r for c, r in zip(deck, removed) ]
+        results = easybj.calculate(rules=dict(rules, cards=cards))
+        records.append((rank, record_values(results, layout).tobytes()))
+    return records
+
+#
+# Builds (or finishes building) the index file of the compositions of a deck
+# with at most depth cards removed, and returns the number of records it
+# calculated
+#
+# rules: rules of every record ('cards' is replaced by each composition)
+# chunk: records calculated by one task
+# processes: size of the worker pool (None for one per CPU, 0 to run inline)
+#
+def build(path, depth=6, rules=None, deck=DECK, chunk=64, processes=None):
+    rules = make_rules(rules)
+    rules.pop('cards')
+    ranking = Ranking(deck, depth)
+    count = len(ranking)
+    layout = record_layout(easybj.calculate(rules=dict(rules, cards=list(deck))))
+    header = json.dumps({ 'rules' : rules, 'deck' : list(deck), 'depth' : depth,
+        'layout' : layout }, sort_keys=True).encode('utf-8')
+    record_size = 8*sum(len(y)*len(x) for name, y, x in layout)
+    flags, records = _layout(len(header), count)
+
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(header)) + header)
+            f.truncate(records + count*record_size)
+    with open(path, 'r+b') as f:
+        mm = mmap.mmap(f.fileno(), 0)
+        try:
+            magic, size = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or mm[HEADER.size:HEADER.size + size] != header:
+                raise ValueError("%s is an index of other rules, deck or depth"%path)
+            todo = [ rank for rank in range(count) if not mm[flags + rank] ]
+            tasks = [ (rules, list(deck), depth, layout, todo[i:i + chunk])
+                for i in range(0, len(todo), chunk) ]
+            if processes == 0:
+                done = map(build_records, tasks)
+            else:
+                pool = Pool(processes)
+                done = pool.imap_unordered(build_records, tasks)
+            try:
+                for results in done:
+                    for rank, data in results:
+                        start = records + rank*record_size
+                        mm[start:start + record_size] = data
+                        mm[flags + rank] = 1
+                    mm.flush()
+            finally:
+                if processes != 0:
+                    pool.close()
+                    pool.join()
+        finally:
+            mm.close()
+    return len(todo)
+
+#
+# Read-only view of an index file. Lookups rank the removed cards and read
+# the record from the map; nothing is calculated.
+#
+class CompositionIndex:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a composition index"%path)
+        header = json.loads(self.mm[HEADER.size:HEADER.size + size].decode('utf-8'))
+        self.rules = header['rules']
+        self.deck = header['deck']
+        self.ranking = Ranking(self.deck, header['depth'])
+        self.layout = header['layout']
+        self.flags, self.records = _layout(size, len(self.ranking))
+        # first cell, row index and column index of each block of a record
+        self.blocks = {}
+        start = 0
+        for name, ylabels, xlabels in self.layout:
+            self.blocks[name] = (start, { y:i for i, y in enumerate(ylabels) },
+                { x:j for j, x in enumerate(xlabels) })
+            start += len(ylabels)*len(xlabels)
+        self.record_size = 8*start
+
+    # number of compositions and number already built
+    def __len__(self):
+        return len(self.ranking)
+
+    def built(self):
+        return sum(self.mm[self.flags:self.flags + len(self.ranking)])
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #
+    # Returns the offset of the record of a composition (cards left of each
+    # value, in DISTINCT order)
+    #
+    def offset(self, cards):
+        rank = self.ranking.rank([ c - n for c, n in zip(self.deck, cards) ])
+        if not self.mm[self.flags + rank]:
+            raise KeyError("composition not built yet")
+        return self.records + rank*self.record_size
+
+    # the cells of the record of a composition as a copied array of doubles
+    # (NaN when empty), so that no view keeps the map from closing
+    def record(self, cards):
+        start = self.offset(cards)
+        record = array('d', self.mm[start:start + self.record_size])
+        if sys.byteorder == 'big':
+            record.byteswap()
+        return record
+
+    #
+    # Returns one cell of a composition: a dealer final score probability
+    # (name 'dealer', dealer label, final score label) or an EV (table name,
+    # player label, dealer label); None for an empty cell
+    #
+    def value(self, cards, name, y, x):
+        start, rows, columns = self.blocks[name]
+        cell = start + rows[y]*len(columns) + columns[x]
+        value, = struct.unpack_from('<d', self.mm, self.offset(cards) + 8*cell)
+        return None if value != value else value
+
+    # dealer final score distributions of a composition, as in the results
+    def dealer(self, cards):
+        record = self.record(cards)
+        start, rows, columns = self.blocks['dealer']
+        return { dc:{ d:record[start + i*len(columns) + j] for d, j in columns.items() }
+            for dc, i in rows.items() }
+
+    # EV Table of a composition
+    def table(self, cards, name):
+        record = self.record(cards)
+        start, rows, columns = self.blocks[name]
+        table = Table(float, columns, rows)
+        for y, i in rows.items():
+            row = table.tabledict[y]
+            for x, j in columns.items():
+                value = record[start + i*len(columns) + j]
+                row[x] = None if value != value else value
+        return table
+
+#
+# python3 compindex.py [PATH [DEPTH]]: builds (or resumes) an index, then
+# checks a few lookups against direct calculations and times the lookups
+#
+def main(argc, argv):
+    path = argv[1] if argc > 1 else "single_deck.idx"
+    depth = int(argv[2]) if argc > 2 else 4
+    start = time.perf_counter()
+    calculated = build(path, depth)
+    elapsed = time.perf_counter() - start
+    with CompositionIndex(path) as index:
+        print("%s: %d compositions (%d calculated in %.1fs), %d bytes per record"%(
+            path, len(index), calculated, elapsed, index.record_size))
+        samples = [ index.ranking.unrank(rank) for rank in range(0, len(index), max(1, len(index)//5)) ]
+        for removed in samples:
+            cards = [ c - r for c, r in zip(DECK, removed) ]
+            results = easybj.calculate(rules={ 'cards' : cards })
+            for name in TABLES:
+                table = index.table(cards, name)
+                for y in table.ylabels:
+                    for x in table.xlabels:
+                        if table[y,x] != results[name][y,x]:
+                            raise AssertionError("%s %s %s differs for %s"%(name, y, x, cards))
+        cards = [ c - r for c, r in zip(DECK, samples[-1]) ]
+        lookups = 100000
+        start = time.perf_counter()
+        for _ in range(lookups):
+            index.value(cards, 'hit', '16', '10')
+        elapsed = time.perf_counter() - start
+        print("lookups match the calculations, %.2fus per cell lookup"%(elapsed/lookups*1e6))
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
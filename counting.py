@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+#
+# counting.py
+#
+# Simulates card counting on whole shuffled shoes: the running and true
+# count, a bet ramp, the computed strategy with count-dependent index plays,
+# and the resulting win rate and SCORE
+#
+
+import math
+import random
+import time
+from multiprocessing import Pool
+
+import codes
+import easybj
+import kernels
+from codes import BUST, NUM_CARDS, NUM_CODES, TWENTY_ONE
+from easybj import double_labels, make_rules
+
+# Hi-Lo tag of each card value (index 0 unused, ace is 1)
+HI_LO = [ 0, -1, 1, 1, 1, 1, 1, 0, 0, 0, -1 ]
+
+# bet ramp: units bet from each true count up (below the first: its units)
+RAMP = [ (1, 1), (2, 2), (3, 4), (4, 6), (5, 8) ]
+
+# lowest and highest true count tracked by the per-count statistics
+TC_RANGE = (-10, 10)
+
+# cards drawn at random past the end of a shoe when a round dealt from the
+# last cards runs out of them
+RESERVE = 64
+
+#
+# Returns the cards of a shoe of the given number of decks (card values,
+# ace is 1)
+#
+def make_shoe(decks):
+    deck = [ card for card in range(1, NUM_CARDS) for _ in range(4) ] + [ NUM_CARDS ]*16
+    return deck*decks
+
+#
+# Returns the true count of a running count with a number of cards left,
+# rounded down (the bet ramp and the index plays read it the same way)
+#
+def true_count(running, cards_left):
+    return math.floor(running/(max(cards_left, 1)/52.))
+
+#
+# Returns the units bet at a true count
+#
+def ramp_bet(ramp, tc):
+    units = ramp[0][1]
+    for count, bet in ramp:
+        if tc >= count:
+            units = bet
+    return units
+
+#
+# Returns the strategy of a result dictionary as flat lists indexed by
+# player code * NUM_CODES + dealer code:
+#
+#   first: action letter of the initial hand ('S', 'H', 'Ds', 'Rh', 'P'...)
+#   more: whether to hit again a hand that has been hit
+#   base: action of a split hand that may no longer split ('S', 'H', 'D')
+#
+def strategy_lists(results, rules=None):
+    rules = make_rules(rules)
+    doubles = set(codes.codes(double_labels(rules)))
+    first = [None]*(NUM_CODES*NUM_CODES)
+    more = [False]*(NUM_CODES*NUM_CODES)
+    base = ['S']*(NUM_CODES*NUM_CODES)
+    stand, hit, double = results['stand'], results['hit'], results['double']
+    for dc in easybj.DEALER_CODE:
+        d = codes.CODE[dc]
+        for pc in easybj.PLAYER_CODE:
+            first[codes.CODE[pc]*NUM_CODES + d] = results['strategy'][pc,dc]
+        for pc in easybj.NON_SPLIT_CODE:
+            c = codes.CODE[pc]
+            s, h = stand[pc,dc], hit[pc,dc]
+            db = double[pc,dc] if c in doubles else float('-inf')
+            more[c*NUM_CODES + d] = h > s
+            base[c*NUM_CODES + d] = 'S' if s >= max(h, db) else ('H' if h >= db else 'D')
+    return first, more, base
+
+#
+# Index plays: { (player label, dealer label): [(true count, action)] } where
+# the action of the highest true count at or below the current one replaces
+# the strategy's (e.g. { ('16', '20'): [(0, 'S')] } stands 16 against the
+# dealer's 20 from a true count of 0 up). A play the rules do not allow
+# (doubling a hand the double rule excludes, splitting when split_hands is 1,
+# surrendering without surrender) is a ValueError.
+#
+def deviation_lists(deviations, rules=None):
+    rules = make_rules(rules)
+    doubles = set(codes.codes(double_labels(rules)))
+    flat = {}
+    for (pc, dc), plays in (deviations or {}).items():
+        c = codes.CODE[pc]
+        pair = codes.is_pair(c)
+        # a pair not split is played as its total
+        total = codes.hand(codes.points(c)) if pair and not codes.is_soft(c) else c
+        for count, action in plays:
+            if action[0] not in 'SHDRP' or (action == 'P' and not pair):
+                raise ValueError("%s is not a valid play for %s"%(action, pc))
+            if action == 'P' and rules['split_hands'] < 2:
+                raise ValueError("splitting %s is not allowed with split_hands %d"%(pc, rules['split_hands']))
+            if action[0] == 'D' and total not in doubles:
+                raise ValueError("doubling %s is not allowed by the double rule %s"%(pc, rules['double']))
+            if action[0] == 'R' and not rules['surrender']:
+                raise ValueError("surrendering %s is not allowed without surrender"%pc)
+        flat[c*NUM_CODES + codes.CODE[dc]] = sorted(plays)
+    return flat
+
+#
+# Plays a number of rounds from freshly shuffled shoes and returns the
+# statistics as a dictionary of sums
+#
+# task: (results, rules, deviations, decks, penetration, ramp, tags, rounds,
+#   seed)
+#
+def simulate_chunk(task):
+    results, rules, deviations, decks, penetration, ramp, tags, rounds, seed = task
+    rules = make_rules(rules)
+    rng = random.Random(seed)
+    first, more, base = strategy_lists(results, rules)
+    deviations = deviation_lists(deviations, rules)
+    stands, final = kernels.dealer_stands(rules['hit_soft17'])
+    blackjack = rules['blackjack']
+    max_hands = rules['split_hands']
+    NEXT = [ code for row in codes.NEXT for code in row ]
+    DEALER_NEXT = [ code for row in codes.DEALER_NEXT for code in row ]
+    score = [ codes.score(c) if c != codes.BJ else 21 for c in range(NUM_CODES) ]
+    FINAL = codes.FINAL_SCORES
+
+    cards = make_shoe(decks)
+    size = len(cards)
+    cut = int(size*penetration)
+    pos = size
+    running = 0
+    shoes = 0
+    lo, hi = TC_RANGE
+    by_count = { tc:[0, 0.] for tc in range(lo, hi + 1) }
+    won = won2 = bet_total = 0.
+
+    for _ in range(rounds):
+        if pos >= cut:
+            rng.shuffle(cards)
+            shoe = cards + rng.choices(cards, k=RESERVE)
+            pos = 0
+            running = 0
+            shoes += 1
+        tc = true_count(running, size - pos)
+        bet = ramp_bet(ramp, tc)
+
+        p1, d1, p2, d2 = shoe[pos:pos+4]
+        pos += 4
+        running += tags[p1] + tags[p2] + tags[d1] + tags[d2]
+        dc = codes.dealer_two_cards(d1, d2)
+        pc = codes.two_cards(p1, p2)
+
+        if dc == codes.BJ:
+            net = 0. if pc == codes.BJ else -1.
+        elif pc == codes.BJ:
+            net = blackjack
+        else:
+            # index plays use the count after seeing all four cards
+            key = pc*NUM_CODES + dc
+            action = first[key]
+            if key in deviations:
+                tc_now = true_count(running, size - pos)
+                for count, play in deviations[key]:
+                    if tc_now >= count:
+                        action = play
+            hands = []
+            if action[0] == 'R':
+                net = rules['surrender_value']
+            else:
+                if action == 'P':
+                    x = codes.pair_card(pc)
+                    todo = [x, x]
+                    count = 2
+                    while todo:
+                        x = todo.pop()
+                        card = shoe[pos]; pos += 1
+                        running += tags[card]
+                        code = NEXT[codes.one_card(x)*NUM_CARDS + card - 1]
+                        if x == 1:
+                            hands.append((code, 'S'))
+                            continue
+                        if card == x and count < max_hands:
+                            todo += [x, x]
+                            count += 1
+                            continue
+                        play = base[code*NUM_CODES + dc] if code != TWENTY_ONE else 'S'
+                        hands.append((code, play))
+                else:
+                    code = pc
+                    if codes.is_pair(pc) and not codes.is_soft(pc):
+                        code = codes.hand(codes.points(pc))
+                    hands.append((code, action[0]))
+                played = []
+                for code, play in hands:
+                    stake = 1
+                    if play == 'D':
+                        card = shoe[pos]; pos += 1
+                        running += tags[card]
+                        code = NEXT[code*NUM_CARDS + card - 1]
+                        stake = 2
+                    elif play == 'H':
+                        while True:
+                            card = shoe[pos]; pos += 1
+                            running += tags[card]
+                            code = NEXT[code*NUM_CARDS + card - 1]
+                            if code == BUST or code == TWENTY_ONE or not more[code*NUM_CODES + dc]:
+                                break
+                    played.append((score[code], stake))
+
+                # the dealer only draws when a hand is still live
+                d = 0
+                if any(s for s, stake in played):
+                    code = dc
+                    while not stands[code]:
+                        card = shoe[pos]; pos += 1
+                        running += tags[card]
+                        code = DEALER_NEXT[code*NUM_CARDS + card - 1]
+                    d = FINAL[final[code]]
+                net = 0.
+                for s, stake in played:
+                    if s == 0:
+                        net -= stake
+                    elif d == 0 or s > d:
+                        net += stake
+                    elif s < d:
+                        net -= stake
+
+        won += bet*net
+        won2 += (bet*net)**2
+        bet_total += bet
+        stats = by_count[min(max(tc, lo), hi)]
+        stats[0] += 1
+        stats[1] += net
+    return { 'rounds' : rounds, 'won' : won, 'won2' : won2, 'bet' : bet_total,
+        'shoes' : shoes, 'by_count' : by_count }
+
+#
+# Simulates rounds of counting play and returns a dictionary of statistics:
+# win rate and standard deviation per round (in units), EV per unit bet,
+# average bet, DI (1000 win rate / sd), SCORE (DI squared), N0 ((sd / win
+# rate) squared, rounds to overcome one standard deviation), and the edge
+# and frequency of each true count
+#
+# results: output of easybj.calculate() (calculated when omitted)
+# rules: rules the results are calculated with (the shoe replaces 'cards')
+# deviations: index plays (see deviation_lists())
+# penetration: fraction of the shoe dealt before shuffling (a round is always
+#   finished, if need be with cards drawn at random past the end)
+# ramp: bet ramp [(true count, units)]
+# tags: count tag of each card value
+# chunk: rounds played by one task (its shoes are independent of the others)
+# processes: size of the worker pool (None for one per CPU, 0 to run inline)
+#
+def simulate(results=None, rules=None, deviations=None, decks=6, penetration=0.75,
+        ramp=RAMP, tags=HI_LO, rounds=1000000, chunk=100000, processes=None, seed=None):
+    if results is None:
+        results = easybj.calculate(rules=rules)
+    # rejects plays the rules do not allow before any worker starts
+    deviation_lists(deviations, rules)
+    rng = random.Random(seed)
+    tasks = []
+    for start in range(0, rounds, chunk):
+        tasks.append((results, rules, deviations, decks, penetration, ramp, tags,
+            min(chunk, rounds - start), rng.getrandbits(64)))
+    if processes == 0:
+        chunks = [ simulate_chunk(task) for task in tasks ]
+    else:
+        with Pool(processes) as pool:
+            chunks = pool.map(simulate_chunk, tasks)
+
+    won = sum(c['won'] for c in chunks)
+    won2 = sum(c['won2'] for c in chunks)
+    bet = sum(c['bet'] for c in chunks)
+    mean = won/rounds
+    sd = math.sqrt(max(won2/rounds - mean*mean, 0.))
+    by_count = {}
+    for c in chunks:
+        for tc, (n, net) in c['by_count'].items():
+            total = by_count.setdefault(tc, [0, 0.])
+            total[0] += n
+            total[1] += net
+    di = 1000*mean/sd if sd > 0. else 0.
+    return {
+        'rounds' : rounds,
+        'shoes' : sum(c['shoes'] for c in chunks),
+        'win_rate' : mean,
+        'sd' : sd,
+        'ev_per_unit' : won/bet,
+        'average_bet' : bet/rounds,
+        'di' : di,
+        'score' : di*di,
+        'n0' : (sd/mean)**2 if mean != 0. else float('inf'),
+        'by_count' : { tc:{ 'frequency' : n/rounds, 'edge' : net/n }
+            for tc, (n, net) in sorted(by_count.items()) if n },
+    }
+
+#
+# Prints the statistics returned by simulate()
+#
+def print_stats(stats, elapsed=None):
+    print("%d rounds from %d shoes"%(stats['rounds'], stats['shoes']) +
+        (" in %.1fs (%.0f rounds/hour)"%(elapsed, stats['rounds']/elapsed*3600) if elapsed else ""))
+    print("win rate %.4f units/round (%.3f%% per unit bet, average bet %.3f)"%(
+        stats['win_rate'], stats['ev_per_unit']*100, stats['average_bet']))
+    print("sd %.4f units/round, DI %.2f, SCORE %.2f, N0 %.0f"%(
+        stats['sd'], stats['di'], stats['score'], stats['n0']))
+    for tc, s in stats['by_count'].items():
+        if s['frequency'] >= 0.001:
+            print("  TC %+3d: %6.2f%% of rounds, edge %+.3f%%"%(tc, s['frequency']*100, s['edge']*100))
+
+if __name__ == "__main__":
+    import sys
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    start = time.perf_counter()
+    stats = simulate(rounds=rounds)
+    print_stats(stats, time.perf_counter() - start)
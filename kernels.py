@@ -0,0 +1,458 @@
+#!/usr/bin/python3
+#
+# kernels.py
+#
+# The numeric stages of the calculation (initial probabilities, dealer
+# recursion, stand, hit, double and split tables, and the best action of
+# each cell) as plain kernels over integer codes and numeric grids. The same
+# kernels run as pure Python or, when Numba is installed, compiled to
+# machine code (and cached on disk next to this module).
+#
+# Grids are lists for pure Python and arrays for a compiled backend, made
+# by the backend and kept for the whole calculation; an empty cell is NaN
+# in both. Constant inputs are converted once, so running a kernel passes
+# its arguments through unchanged, and grids only become lists again when
+# they are published to Tables.
+#
+# Every kernel only uses integers, floats, loops and indexing so that Numba
+# can compile it unchanged, and keeps the floating point operations of the
+# original methods in the same order so that every backend gives the same
+# tables.
+#
+
+import time
+import warnings
+
+import codes
+from codes import BUST, NUM_CARDS, TWENTY_ONE
+
+# number of dealer final scores
+NUM_FINAL = len(codes.FINAL_SCORES)
+
+# code of a hand of one card, indexed by card value (index 0 unused)
+ONE_CARD = [ 0 ] + [ codes.one_card(card) for card in range(1, NUM_CARDS + 1) ]
+
+# code of a pair, indexed by card value (index 0 unused)
+PAIR_CODE = [ 0 ] + [ codes.pair(card) for card in range(1, NUM_CARDS + 1) ]
+
+# code of the player's and the dealer's two-card hands, indexed by card
+# index (card value minus one)
+TWO_CARDS = [ [ codes.two_cards(a, b) for b in range(1, NUM_CARDS + 1) ]
+    for a in range(1, NUM_CARDS + 1) ]
+DEALER_TWO_CARDS = [ [ codes.dealer_two_cards(a, b) for b in range(1, NUM_CARDS + 1) ]
+    for a in range(1, NUM_CARDS + 1) ]
+
+# score of each code when standing
+SCORES = [ codes.score(c) for c in range(codes.NUM_CODES) ]
+
+# the code a hand is played as when it is not split (a pair as its total;
+# AA is already soft 12)
+TOTALS = [ codes.hand(codes.points(c)) if codes.is_pair(c) and not codes.is_soft(c) else c
+    for c in range(codes.NUM_CODES) ]
+
+# dealer final scores in distribution order
+FINAL_SCORES = list(codes.FINAL_SCORES)
+
+# first actions in the order of the operands of optimal_kernel(), and the
+# best of standing and hitting
+FIRST_ACTIONS = ['P', 'S', 'H', 'D', 'R']
+SECOND_ACTIONS = ['s', 'h']
+
+#
+# Returns whether the dealer stands on each code and the index of its final
+# score (soft 17 stands unless the dealer hits it)
+#
+def dealer_stands(hit_soft17=True):
+    stands = [ int(c <= TWENTY_ONE and codes.dealer_stands(c)) for c in range(codes.NUM_CODES) ]
+    if not hit_soft17:
+        stands[codes.soft(17)] = 1
+    final = [ codes.FINAL[codes.score(c)] if stands[c] else 0
+        for c in range(codes.NUM_CODES) ]
+    return stands, final
+
+#
+# Returns the dealer codes reachable from the given ones, each after all the
+# codes it can reach (the order the recursion finishes them in)
+#
+def dealer_order(dealer_codes, stands):
+    order = []
+    seen = set()
+    def visit(dc):
+        if dc in seen:
+            return
+        seen.add(dc)
+        if not stands[dc]:
+            for next_dc in codes.DEALER_NEXT[dc]:
+                visit(next_dc)
+        order.append(dc)
+    for dc in dealer_codes:
+        visit(dc)
+    return order
+
+#
+# Dealer final score distributions: out[dc][i] is the probability of
+# FINAL_SCORES[i] from code dc (out starts as zeros)
+#
+def dealer_kernel(order, stands, stand_final, dealer_next, card_prob, out):
+    for i in range(len(order)):
+        dc = order[i]
+        if stands[dc]:
+            out[dc][stand_final[dc]] = 1.
+            continue
+        for card in range(NUM_CARDS):
+            p = card_prob[card]
+            next_dc = dealer_next[dc][card]
+            for j in range(NUM_FINAL):
+                out[dc][j] += p*out[next_dc][j]
+
+#
+# Probability of each two-card player hand against each two-card dealer hand
+# (initial starts empty)
+#
+def initial_kernel(two_cards, dealer_two_cards, card_prob, initial):
+    for i in range(NUM_CARDS):
+        for j in range(NUM_CARDS):
+            dc = dealer_two_cards[i][j]
+            for x in range(NUM_CARDS):
+                for y in range(NUM_CARDS):
+                    pc = two_cards[x][y]
+                    prob = card_prob[i]*card_prob[j]*(card_prob[x]*card_prob[y])
+                    if initial[pc][dc] != initial[pc][dc]:
+                        initial[pc][dc] = prob
+                    else:
+                        initial[pc][dc] += prob
+
+#
+# Stand EV of the hands in stand_codes from the dealer distributions
+#
+def stand_kernel(stand_codes, dealer_codes, scores, final_scores, dealer, stand):
+    for i in range(len(stand_codes)):
+        pc = stand_codes[i]
+        s = scores[pc]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            ev = 0.
+            for k in range(NUM_FINAL):
+                d = final_scores[k]
+                q = dealer[dc][k]
+                if d == BUST or s > d:
+                    ev += q
+                elif s < d:
+                    ev -= q
+            stand[pc][dc] = ev
+
+#
+# Double EV of the hands in double_codes (one card, then stand at twice the
+# bet)
+#
+def double_kernel(double_codes, dealer_codes, next_code, card_prob, stand, double):
+    for i in range(len(double_codes)):
+        pc = double_codes[i]
+        bust = 0.
+        for card in range(NUM_CARDS):
+            if next_code[pc][card] == BUST:
+                bust += card_prob[card]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            ev = -2*bust
+            for card in range(NUM_CARDS):
+                next_pc = next_code[pc][card]
+                if next_pc != BUST:
+                    ev += 2*card_prob[card]*stand[next_pc][dc]
+            double[pc][dc] = ev
+
+#
+# Base of the split hands: the best of standing, hitting and (where
+# can_double) doubling of the hands in stand_codes, empty cells ignored
+#
+def base_kernel(stand_codes, dealer_codes, can_double, stand, hit, double, base):
+    for i in range(len(stand_codes)):
+        pc = stand_codes[i]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            best = stand[pc][dc]
+            value = hit[pc][dc]
+            if value == value and (best != best or value > best):
+                best = value
+            if can_double[pc]:
+                value = double[pc][dc]
+                if value == value and (best != best or value > best):
+                    best = value
+            if best == best:
+                base[pc][dc] = best
+
+#
+# Best first action of the hands in player_codes: optimal gets its EV, best
+# the index in FIRST_ACTIONS of the first action with that EV (split, stand,
+# hit, double where can_double, surrender where offered), and second the
+# index in SECOND_ACTIONS of the best of standing and hitting (standing on a
+# tie). Pairs not split are played as their total.
+#
+def optimal_kernel(player_codes, dealer_codes, totals, can_double, surrender,
+        surrender_ev, split, stand, hit, double, optimal, best, second):
+    for i in range(len(player_codes)):
+        pc = player_codes[i]
+        t = totals[pc]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            top = split[pc][dc]
+            index = 0
+            s = stand[t][dc]
+            h = hit[t][dc]
+            if s == s and (top != top or s > top):
+                top, index = s, 1
+            if h == h and (top != top or h > top):
+                top, index = h, 2
+            if can_double[t]:
+                d = double[t][dc]
+                if d == d and (top != top or d > top):
+                    top, index = d, 3
+            if surrender and (top != top or surrender_ev > top):
+                top, index = surrender_ev, 4
+            if top != top:
+                continue
+            optimal[pc][dc] = top
+            best[pc][dc] = index
+            if s == s and (h != h or s >= h):
+                second[pc][dc] = 0
+            elif h == h:
+                second[pc][dc] = 1
+
+#
+# Hit EV of the hands in hit_order (every hand after the hands it reaches)
+#
+def hit_kernel(hit_order, dealer_codes, next_code, card_prob, stand, hit):
+    for i in range(len(hit_order)):
+        pc = hit_order[i]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            ev = 0.
+            for card in range(NUM_CARDS):
+                next_pc = next_code[pc][card]
+                if next_pc == BUST:
+                    value = -1.
+                elif next_pc == TWENTY_ONE:
+                    value = stand[next_pc][dc]
+                else:
+                    value = stand[next_pc][dc]
+                    if hit[next_pc][dc] > value:
+                        value = hit[next_pc][dc]
+                ev += card_prob[card]*value
+            hit[pc][dc] = ev
+
+#
+# Two split hands of pairs 22 to TT, neither of which can split again
+#
+def resplit1_kernel(dealer_codes, next_code, card_prob, one_card, pair_code,
+        resplit0, resplit1):
+    for x in range(2, NUM_CARDS + 1):
+        px = card_prob[x-1]
+        one = one_card[x]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            other = 0.
+            for card in range(NUM_CARDS):
+                if card + 1 != x:
+                    other += card_prob[card]*resplit0[next_code[one][card]][dc]
+            ev = other + px*resplit0[2*x][dc]
+            resplit1[pair_code[x]][dc] = ev*2
+
+#
+# Two split hands of pairs 22 to TT, one of which can split again
+#
+def resplit2_kernel(dealer_codes, next_code, card_prob, one_card, pair_code,
+        resplit0, resplit1, resplit2):
+    for x in range(2, NUM_CARDS + 1):
+        px = card_prob[x-1]
+        q = 1 - px
+        one = one_card[x]
+        pc = pair_code[x]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            other = 0.
+            for card in range(NUM_CARDS):
+                if card + 1 != x:
+                    other += card_prob[card]*resplit0[next_code[one][card]][dc]
+            ev = 2*px*(q*resplit1[pc][dc] + other)
+            ev += px*px*(resplit1[pc][dc] + resplit0[2*x][dc])
+            ev += 2*q*other
+            resplit2[pc][dc] = ev
+
+#
+# Initial split of every pair (split aces receive one card each)
+#
+def split_kernel(dealer_codes, next_code, card_prob, one_card, pair_code,
+        stand, resplit0, resplit1, resplit2, split):
+    aces = one_card[1]
+    for j in range(len(dealer_codes)):
+        dc = dealer_codes[j]
+        ev = 0.
+        for card in range(NUM_CARDS):
+            ev += card_prob[card]*stand[next_code[aces][card]][dc]
+        split[pair_code[1]][dc] = 2*ev
+
+    for x in range(2, NUM_CARDS + 1):
+        px = card_prob[x-1]
+        q = 1 - px
+        one = one_card[x]
+        pc = pair_code[x]
+        for j in range(len(dealer_codes)):
+            dc = dealer_codes[j]
+            other = 0.
+            for card in range(NUM_CARDS):
+                if card + 1 != x:
+                    other += card_prob[card]*resplit0[next_code[one][card]][dc]
+            ev = 2*px*(q*resplit2[pc][dc] + other)
+            ev += px*px*2*resplit1[pc][dc]
+            ev += 2*q*other
+            split[pc][dc] = ev
+
+# all the kernels by name
+KERNELS = {
+    'initial' : initial_kernel,
+    'dealer' : dealer_kernel,
+    'stand' : stand_kernel,
+    'double' : double_kernel,
+    'base' : base_kernel,
+    'optimal' : optimal_kernel,
+    'hit' : hit_kernel,
+    'resplit1' : resplit1_kernel,
+    'resplit2' : resplit2_kernel,
+    'split' : split_kernel,
+}
+
+#
+# Runs kernels on grids and inputs made by the backend. The pure Python
+# backend uses lists; a compiled backend uses numeric arrays.
+#
+class Backend:
+    def __init__(self, name, kernels, numpy=None):
+        self.name = name
+        self.kernels = kernels
+        self.numpy = numpy
+        # constant inputs already converted, by name
+        self.constants = {}
+
+    # run a kernel on the backend's grids and inputs
+    def run(self, kernel, *args):
+        self.kernels[kernel](*args)
+
+    # a new grid indexed by [player code][dealer code] of empty cells
+    def grid(self):
+        if self.numpy is None:
+            return [ [EMPTY]*codes.NUM_CODES for _ in range(codes.NUM_CODES) ]
+        return self.numpy.full((codes.NUM_CODES, codes.NUM_CODES), self.numpy.nan)
+
+    # a new grid of rows of zeros
+    def zeros(self, rows, width):
+        if self.numpy is None:
+            return [ [0.]*width for _ in range(rows) ]
+        return self.numpy.zeros((rows, width))
+
+    # a grid of rows of the given width (None rows are zeros)
+    def rows(self, values, width):
+        grid = self.zeros(len(values), width)
+        for i, row in enumerate(values):
+            if row is not None:
+                grid[i][:] = row
+        return grid
+
+    # a grid as lists (to read it cell by cell from Python)
+    def tolist(self, grid):
+        return grid if isinstance(grid, list) else grid.tolist()
+
+    # an input of a kernel: a list of numbers or of rows as the backend's
+    # array (lists as they are for pure Python)
+    def array(self, values):
+        np = self.numpy
+        if np is None:
+            return values
+        rows = values if values and isinstance(values[0], list) else [values]
+        numeric = [ v for row in rows for v in row ]
+        if all(isinstance(v, int) for v in numeric):
+            return np.array(values, dtype=np.int64)
+        if rows is values:
+            return np.array([ [ np.nan if v is None else v for v in row ] for row in values ])
+        return np.array(values, dtype=np.float64)
+
+    # an input that never changes, converted on first use only
+    def constant(self, name, values):
+        if name not in self.constants:
+            self.constants[name] = self.array(values)
+        return self.constants[name]
+
+# value of an empty grid cell
+EMPTY = float('nan')
+
+PYTHON = Backend('python', KERNELS)
+
+# backends built so far, by name
+_backends = { 'python' : PYTHON }
+
+# the Numba backend (compiled lazily on first use; None without Numba)
+def numba_backend():
+    if 'numba' not in _backends:
+        try:
+            import numba
+            import numpy
+        except ImportError:
+            _backends['numba'] = None
+        else:
+            compiled = { name:numba.njit(cache=True)(kernel) for name, kernel in KERNELS.items() }
+            _backends['numba'] = Backend('numba', compiled, numpy)
+    return _backends['numba']
+
+#
+# Returns the backend of a name: 'python', 'numba' (pure Python with a
+# warning when Numba is not installed) or 'auto' (Numba when installed)
+#
+def backend(name='python'):
+    if isinstance(name, Backend):
+        return name
+    if name == 'python':
+        return PYTHON
+    if name in ('numba', 'auto'):
+        compiled = numba_backend()
+        if compiled is not None:
+            return compiled
+        if name == 'numba':
+            warnings.warn("numba is not installed, using the python backend")
+        return PYTHON
+    raise ValueError("unknown backend %s"%name)
+
+# the workloads of the benchmark, lists of rule sets: the infinite deck, and
+# the compositions of a single deck after one card was dealt (a finite shoe
+# needs one calculation per composition; each calculation costs the same as
+# the infinite deck's, its card weights being fixed for the round)
+WORKLOADS = {
+    'infinite deck' : [None],
+    'single deck compositions' : [ { 'cards' : [ 4 - (i == j) for i in range(9) ] + [16 - (j == 9)] }
+        for j in range(10) ],
+}
+
+#
+# Prints the time of easybj.calculate() with each available backend on all
+# the rule sets of each workload (best of repeat runs; compilation happens
+# before timing)
+#
+def benchmark(repeat=5):
+    import easybj
+    names = ['python'] + (['numba'] if numba_backend() is not None else [])
+    if len(names) == 1:
+        print("numba is not installed, only the python backend is timed")
+    for workload, rule_sets in WORKLOADS.items():
+        base = None
+        for name in names:
+            easybj.calculate(rules=rule_sets[0], backend=name)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for rules in rule_sets:
+                    easybj.calculate(rules=rules, backend=name)
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            base = base or best
+            print("%-24s %-7s %.4fs  speedup %.2fx"%(workload, name, best, base/best))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+#
+# multispot.py
+#
+# EV, variance and covariance of k spots played against the same dealer hand
+#
+# Spots are correlated through the dealer's hand they all play against: given
+# the dealer's initial code and final score the spots are independent, so a
+# single dealer distribution per composition serves every spot and the total
+# of k spots is a mixture of k-fold convolutions (cost linear in k).
+#
+# With the infinite shoe (or the card weights of the 'cards' rule) the
+# shared dealer hand is the only source of correlation. With a finite shoe
+# the dealer's two cards are dealt from it and removed: every dealer hand
+# has its own composition, and the spots are played with the weights of the
+# shoe less the dealer's cards (one calculation per dealer hand, whatever
+# the number of spots). That depletion is shared by every spot, like the
+# dealer hand. The cards the spots take are not removed: a spot's cards do
+# not change what the other spots or the dealer draw, nor do the cards drawn
+# during the round.
+#
+
+import math
+
+import codes
+import easybj
+from easybj import DEALER_CODE, DISTINCT, INITIAL_CODE
+from outcome import OutcomeModel, accumulate, convolve
+
+# number of spots reported by default (a full table)
+SPOTS = range(1, 8)
+
+#
+# Returns [(probability, distribution)] of one spot's net result conditional
+# on each joint state of the dealer (initial code, final score)
+#
+def dealer_states(model):
+    initprob = model.results['initial']
+    states = []
+    for dc in DEALER_CODE + ['BJ']:
+        pdc = sum(initprob[pc,dc] for pc in INITIAL_CODE)
+        if pdc > 0.:
+            states += code_states(model, dc, pdc)
+    return states
+
+#
+# Returns the dealer states of dealer code dc, of probability pdc
+#
+def code_states(model, dc, pdc):
+    initprob = model.results['initial']
+    # the spot's initial hand given the dealer's
+    spot = sum(initprob[pc,dc] for pc in INITIAL_CODE)
+    if dc == 'BJ':
+        # only a player blackjack pushes against the dealer's blackjack
+        pbj = initprob['BJ',dc]/spot
+        return [(pdc, { 0.: pbj, -1.: 1. - pbj })]
+    states = []
+    for d, pd in model.dealprob[dc].items():
+        dist = {}
+        for pc in INITIAL_CODE:
+            p = initprob[pc,dc]/spot
+            if p <= 0.:
+                continue
+            if pc == 'BJ':
+                accumulate(dist, { model.blackjack: 1. }, p)
+            else:
+                accumulate(dist, model.cell_conditional(pc, dc, d), p)
+        states.append((pdc*pd, dist))
+    return states
+
+#
+# Returns the dealer states of a finite shoe (the number of cards of each
+# value in DISTINCT order), every dealer hand dealt from the shoe and
+# played with its two cards removed
+#
+def shoe_states(shoe, rules=None):
+    total = sum(shoe)
+    if total < 2 or any(n < 0 for n in shoe):
+        raise ValueError("a shoe must hold at least two cards")
+    states = []
+    for a in range(len(DISTINCT)):
+        for b in range(a, len(DISTINCT)):
+            # both orders of the two cards, without replacement
+            p = shoe[a]*(shoe[b] - (a == b))/(total*(total - 1))*(1 if a == b else 2)
+            if p <= 0.:
+                continue
+            cards = list(shoe)
+            cards[a] -= 1
+            cards[b] -= 1
+            dc = codes.LABELS[codes.dealer_two_cards(a + 1, b + 1)]
+            hand_rules = dict(rules or {}, cards=cards)
+            model = OutcomeModel(easybj.calculate(rules=hand_rules), hand_rules)
+            states += code_states(model, dc, p)
+    return states
+
+# mean and second moment of a distribution
+def moments(dist):
+    mean = sum(x*p for x, p in dist.items())
+    return mean, sum(x*x*p for x, p in dist.items())
+
+#
+# Returns { k: statistics } of k spots played in the same round
+#
+# results: output of easybj.calculate() (calculated when omitted)
+# rules: rules the results are calculated with (the 'cards' rule weights
+#   the card values for the whole round)
+# distribution: also return the distribution of the total of the k spots
+# shoe: number of cards of each value in DISTINCT order of a finite shoe
+#   the dealer's hand is dealt from (results are then calculated for each
+#   dealer hand and results is ignored)
+#
+def multispot(spots=SPOTS, results=None, rules=None, distribution=True, shoe=None):
+    if shoe is not None:
+        states = shoe_states(shoe, rules)
+    else:
+        if results is None:
+            results = easybj.calculate(rules=rules)
+        states = dealer_states(OutcomeModel(results, rules))
+
+    # E[X], E[X^2] and E[X Y] of two spots X and Y of the same round
+    mean = second = cross = 0.
+    for p, dist in states:
+        m, s = moments(dist)
+        mean += p*m
+        second += p*s
+        cross += p*m*m
+    variance = second - mean*mean
+    covariance = cross - mean*mean
+
+    spots = sorted(spots)
+    totals = {}
+    if distribution and spots:
+        # one pass of convolutions per dealer state serves every k
+        for k in spots:
+            totals[k] = {}
+        for p, dist in states:
+            total = { 0.: 1. }
+            for k in range(1, spots[-1] + 1):
+                total = convolve(total, dist)
+                if k in totals:
+                    accumulate(totals[k], total, p)
+
+    stats = {}
+    for k in spots:
+        var = k*variance + k*(k - 1)*covariance
+        stats[k] = {
+            'ev' : k*mean,
+            'ev_per_spot' : mean,
+            'variance' : var,
+            'sd' : math.sqrt(var),
+            'covariance' : covariance,
+            'correlation' : covariance/variance,
+        }
+        if distribution:
+            stats[k]['distribution'] = totals[k]
+    return stats
+
+#
+# Prints the statistics returned by multispot()
+#
+def print_stats(stats):
+    print("spots       EV   variance        sd  sd/spot")
+    for k, s in stats.items():
+        print("%5d %8.4f%% %10.4f %9.4f %8.4f"%(k, s['ev']*100, s['variance'], s['sd'], s['sd']/k))
+    s = next(iter(stats.values()))
+    print("covariance between spots %.4f (correlation %.4f)"%(s['covariance'], s['correlation']))
+
+if __name__ == "__main__":
+    print("infinite shoe")
+    print_stats(multispot())
+    print("single deck, dealer's cards removed")
+    print_stats(multispot(shoe=[4]*9 + [16]))
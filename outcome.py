@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+#
+# outcome.py
+#
+# Exact outcome distributions (in net units of the initial bet) implied by
+# the initial probability table and the optimal strategy
+#
+
+import codes
+from codes import BUST, LABELS, NEXT
+from easybj import DEALER_CODE, INITIAL_CODE, card_probabilities, double_labels, make_rules
+
+# pseudo-score of a surrendered hand
+SURRENDER = -1
+
+# all the dealer final scores (0 is bust)
+DEALER_FINAL = codes.FINAL_SCORES
+
+#
+# Returns the net result of a single unit hand with final score t against
+# the dealer's final score d
+#
+def payoff(t, d, surrender=-0.5):
+    if t == SURRENDER:
+        return surrender
+    if t == 0:
+        return -1.
+    if d == 0 or t > d:
+        return 1.
+    return 0. if t == d else -1.
+
+#
+# Returns the convolution of two distributions (dict value -> probability)
+#
+def convolve(a, b):
+    result = {}
+    for x, p in a.items():
+        for y, q in b.items():
+            result[x+y] = result.get(x+y, 0.) + p*q
+    return result
+
+#
+# Adds weight * b into distribution a
+#
+def accumulate(a, b, weight=1.):
+    for x, p in b.items():
+        a[x] = a.get(x, 0.) + weight*p
+    return a
+
+#
+# Computes outcome distributions from the result dictionary of
+# easybj.calculate(). Every distribution is conditional on the dealer's final
+# score first, since all the hands of a round share the same dealer hand.
+# Hands are integer codes (see codes.py); dealer hands are table labels.
+#
+# rules: the rules the results were calculated with
+#
+class OutcomeModel:
+    def __init__(self, results, rules=None):
+        self.results = results
+        self.rules = make_rules(rules)
+        self.blackjack = self.rules['blackjack']
+        self.card_prob = card_probabilities(self.rules)
+        self.doubles = set(codes.codes(double_labels(self.rules)))
+        self.resplits = self.rules['split_hands'] - 2
+        self.dealprob = {}
+        for dc in DEALER_CODE:
+            self.dealprob[dc] = { int(d):p for d, p in results['dealer'][dc].items() }
+        self._finals = {}
+        self._base = {}
+        self._split = {}
+
+    # EV of a hand code in one of the result tables
+    def ev(self, name, pc, dc):
+        return self.results[name][LABELS[pc],dc]
+
+    # distribution of the final score when playing stand or hit optimally
+    def final_scores(self, pc, dc):
+        key = (pc, dc)
+        if key in self._finals:
+            return self._finals[key]
+        if pc == BUST or pc == codes.TWENTY_ONE or \
+                self.ev('stand', pc, dc) >= self.ev('hit', pc, dc):
+            result = { codes.score(pc): 1. }
+        else:
+            result = self.hit_scores(pc, dc)
+        self._finals[key] = result
+        return result
+
+    # distribution of the final score after one hit followed by optimal play
+    def hit_scores(self, pc, dc):
+        result = {}
+        for card, next_pc in enumerate(NEXT[pc]):
+            accumulate(result, self.final_scores(next_pc, dc), self.card_prob[card])
+        return result
+
+    # distribution of (score, stake) after doubling down
+    def double_scores(self, pc):
+        result = {}
+        for card, next_pc in enumerate(NEXT[pc]):
+            key = (codes.score(next_pc), 2)
+            result[key] = result.get(key, 0.) + self.card_prob[card]
+        return result
+
+    # distribution of (score, stake) for the given action letter
+    def action_scores(self, action, pc, dc):
+        if action == 'S':
+            return { (codes.score(pc), 1): 1. }
+        if action == 'H':
+            return { (s, 1):p for s, p in self.hit_scores(pc, dc).items() }
+        if action[0] == 'D':
+            return self.double_scores(pc)
+        if action[0] == 'R':
+            return { (SURRENDER, 1): 1. }
+        raise ValueError("unknown action %s"%action)
+
+    # net distribution of one hand of (score, stake) given dealer score d
+    def settle(self, scores, d):
+        result = {}
+        for (t, stake), p in scores.items():
+            x = stake*payoff(t, d, self.rules['surrender_value'])
+            result[x] = result.get(x, 0.) + p
+        return result
+
+    # net distribution of a post-split hand that may no longer split, given
+    # the dealer's final score d (mirrors the resplit0 table)
+    def base_hand(self, pc, dc, d):
+        key = (pc, dc, d)
+        if key not in self._base:
+            if pc == codes.TWENTY_ONE:
+                action = 'S'
+            else:
+                s = self.ev('stand', pc, dc)
+                h = self.ev('hit', pc, dc)
+                db = self.ev('double', pc, dc) if pc in self.doubles else float('-inf')
+                action = 'S' if s >= max(h, db) else ('H' if h >= db else 'D')
+            self._base[key] = self.settle(self.action_scores(action, pc, dc), d)
+        return self._base[key]
+
+    # net distribution of splitting pair card x with the given number of
+    # resplits left (as many as the rules allow when omitted), given the
+    # dealer's final score d (mirrors the resplit1, resplit2 and split tables)
+    def split_hands(self, x, dc, d, resplits=None):
+        if resplits is None:
+            resplits = self.resplits
+        key = (x, dc, d, resplits)
+        if key in self._split:
+            return self._split[key]
+        one = codes.one_card(x)
+        if x == 1:
+            hand = {}
+            for card, next_pc in enumerate(NEXT[one]):
+                accumulate(hand, { payoff(codes.score(next_pc), d): 1. }, self.card_prob[card])
+            result = convolve(hand, hand)
+        elif resplits == 0:
+            hand = {}
+            for card, next_pc in enumerate(NEXT[one]):
+                accumulate(hand, self.base_hand(next_pc, dc, d), self.card_prob[card])
+            result = convolve(hand, hand)
+        else:
+            px = self.card_prob[x-1]
+            again = self.split_hands(x, dc, d, resplits-1)
+            other = {}
+            for card, next_pc in enumerate(NEXT[one]):
+                if card + 1 != x:
+                    accumulate(other, self.base_hand(next_pc, dc, d), self.card_prob[card])
+            # exactly one hand receives x, both do, or neither does
+            result = accumulate({}, convolve(again, other), 2*px)
+            if resplits == 1:
+                both = convolve(again, self.base_hand(NEXT[one][x-1], dc, d))
+            else:
+                both = self.split_hands(x, dc, d, 0)
+                both = convolve(both, both)
+            accumulate(result, both, px*px)
+            accumulate(result, convolve(other, other))
+        self._split[key] = result
+        return result
+
+    # net distribution of the optimal action (or of the given action letter)
+    # for initial cell (pc, dc) given the dealer's final score d
+    def cell_conditional(self, pc, dc, d, action=None):
+        if action is None:
+            action = self.results['strategy'][pc,dc]
+        code = codes.CODE[pc]
+        if action == 'P':
+            return self.split_hands(codes.pair_card(code), dc, d)
+        # a pair that is not split is played as its total
+        if codes.is_pair(code) and not codes.is_soft(code):
+            code = codes.hand(codes.points(code))
+        return self.settle(self.action_scores(action, code, dc), d)
+
+    # net distribution of the optimal action (or of the given action letter)
+    # for initial cell (pc, dc)
+    def cell_distribution(self, pc, dc, action=None):
+        result = {}
+        for d, pd in self.dealprob[dc].items():
+            accumulate(result, self.cell_conditional(pc, dc, d, action), pd)
+        return result
+
+    # net distribution of a whole round
+    def round_distribution(self):
+        initprob = self.results['initial']
+        result = {}
+        for pc in INITIAL_CODE:
+            for dc in DEALER_CODE + ['BJ']:
+                p = initprob[pc,dc]
+                if pc == 'BJ':
+                    x = 0. if dc == 'BJ' else self.blackjack
+                    accumulate(result, { x: 1. }, p)
+                elif dc == 'BJ':
+                    accumulate(result, { -1.: 1. }, p)
+                else:
+                    accumulate(result, self.cell_distribution(pc, dc), p)
+        return result
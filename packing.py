@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+#
+# packing.py
+#
+# Packs strategy tables into 4 bits per cell, deduplicates them by content
+# hash, diffs them and groups rule sets by identical strategy
+#
+
+import hashlib
+import json
+
+from easybj import DEALER_CODE, PLAYER_CODE, make_rules
+from table import Table
+
+# action of each 4-bit code (0 is an empty cell)
+ACTIONS = [ None, 'S', 'H', 'Ds', 'Dh', 'Rs', 'Rh', 'P' ]
+
+# 4-bit code of each action
+ACTION_CODE = { action:i for i, action in enumerate(ACTIONS) }
+
+#
+# Returns the cells of a strategy table packed two per byte, row by row (the
+# first cell of a byte in its low 4 bits)
+#
+def pack(table):
+    cells = [ ACTION_CODE[table.tabledict[y][x]] for y in table.ylabels for x in table.xlabels ]
+    if len(cells) % 2:
+        cells.append(0)
+    return bytes(cells[i] | cells[i+1] << 4 for i in range(0, len(cells), 2))
+
+#
+# Returns the strategy Table of packed cells
+#
+def unpack(data, xlabels=DEALER_CODE, ylabels=PLAYER_CODE):
+    table = Table(str, xlabels, ylabels)
+    n = len(table.xlabels)
+    value = int.from_bytes(data, 'little')
+    for i, y in enumerate(table.ylabels):
+        row = table.tabledict[y]
+        for j, x in enumerate(table.xlabels):
+            row[x] = ACTIONS[value >> 4*(i*n + j) & 15]
+    return table
+
+# content hash of packed cells
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+#
+# Returns the indexes of the cells that differ between two packed strategies
+# of the same labels (one XOR over the whole table, then one step per
+# differing cell)
+#
+def diff_cells(a, b):
+    if len(a) != len(b):
+        raise ValueError("strategies of different sizes")
+    x = int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')
+    cells = []
+    while x:
+        cell = ((x & -x).bit_length() - 1) >> 2
+        cells.append(cell)
+        x &= ~(15 << 4*cell)
+    return cells
+
+#
+# Returns [(player label, dealer label, action in a, action in b)] of the
+# cells that differ between two packed strategies
+#
+def diff(a, b, xlabels=DEALER_CODE, ylabels=PLAYER_CODE):
+    n = len(xlabels)
+    va, vb = int.from_bytes(a, 'little'), int.from_bytes(b, 'little')
+    return [ (ylabels[cell // n], xlabels[cell % n],
+        ACTIONS[va >> 4*cell & 15], ACTIONS[vb >> 4*cell & 15]) for cell in diff_cells(a, b) ]
+
+# canonical key of a rule set
+def rules_key(rules):
+    return json.dumps(make_rules(rules), sort_keys=True)
+
+#
+# Packed strategies of many rule sets, each distinct strategy stored once
+#
+class StrategyStore:
+    def __init__(self, xlabels=DEALER_CODE, ylabels=PLAYER_CODE):
+        self.xlabels = tuple(xlabels)
+        self.ylabels = tuple(ylabels)
+        # packed cells by digest, and digest by rules key
+        self.strategies = {}
+        self.configs = {}
+
+    # number of distinct strategies
+    def __len__(self):
+        return len(self.strategies)
+
+    # store the strategy table of a rule set and return its digest
+    def add(self, rules, table):
+        if table.xlabels != self.xlabels or table.ylabels != self.ylabels:
+            raise ValueError("table labels do not match the store")
+        data = pack(table)
+        key = digest(data)
+        self.strategies.setdefault(key, data)
+        self.configs[rules_key(rules)] = key
+        return key
+
+    # store the strategy of each (rules, results) pair
+    def ingest(self, items):
+        for rules, results in items:
+            self.add(rules, results['strategy'])
+
+    # packed strategy of a rule set
+    def packed(self, rules):
+        return self.strategies[self.configs[rules_key(rules)]]
+
+    # strategy Table of a rule set
+    def table(self, rules):
+        return unpack(self.packed(rules), self.xlabels, self.ylabels)
+
+    # cells that differ between the strategies of two rule sets
+    def diff(self, rules_a, rules_b):
+        return diff(self.packed(rules_a), self.packed(rules_b), self.xlabels, self.ylabels)
+
+    #
+    # Returns { digest: [rules] } of the rule sets sharing each strategy,
+    # largest group first
+    #
+    def groups(self):
+        groups = {}
+        for key, strategy in self.configs.items():
+            groups.setdefault(strategy, []).append(json.loads(key))
+        return dict(sorted(groups.items(), key=lambda item: -len(item[1])))
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+#
+# parallel.py
+#
+# Builds the EV tables in a process pool, one task per group of dealer codes
+#
+
+import time
+from multiprocessing import Pool
+
+import telemetry
+from easybj import Calculator, DEALER_CODE, calculate as calculate_serial
+
+#
+# Splits the dealer codes into the given number of groups. Codes are dealt
+# round robin so that cheap (high) and expensive (low) columns mix.
+#
+def dealer_groups(groups, dealer_codes=DEALER_CODE):
+    groups = max(1, min(groups, len(dealer_codes)))
+    return [ list(dealer_codes[i::groups]) for i in range(groups) ]
+
+#
+# Task run by each worker: build all the EV grid columns of a group of
+# dealer codes and return them as { grid index: { dc: column } }, with the
+# column indexed by integer player code
+#
+# task: (dealer_codes, dealer, rules, backend) where dealer is
+# Calculator.dealer
+#
+def make_columns(task):
+    dealer_codes, dealer, rules, backend = task
+    calc = Calculator(dealer_codes, rules, backend)
+    calc.dealer = dealer
+    # observers registered in the parent only see the parent's stages
+    calc.recorder = telemetry.NULL
+    calc.make_ev_tables()
+    columns = {}
+    for i, grid in enumerate(calc.ev_grids()):
+        columns[i] = { dc:[ row[dc] for row in grid ] for dc in calc.dealer_codes }
+    return columns
+
+#
+# Merges the columns returned by make_columns() into the calculator's grids
+#
+def merge_columns(calc, columns):
+    grids = calc.ev_grids()
+    for i, grid_columns in columns.items():
+        grid = grids[i]
+        for dc, column in grid_columns.items():
+            for pc, value in enumerate(column):
+                grid[pc][dc] = value
+
+#
+# Same as easybj.calculate(), but the EV tables are built by a pool of
+# worker processes
+#
+# workers: number of processes
+# groups: number of tasks (defaults to one per dealer code)
+# rules: rules overriding easybj.RULES
+# backend: backend of the kernels (see kernels.py)
+#
+def calculate(workers, groups=None, pool=None, rules=None, backend='python'):
+    calc = Calculator(rules=rules, backend=backend)
+    stage = calc.recorder.stage
+    stage('initial', calc.make_initial_table, calc.initial)
+    calc.verify_initial_table()
+    stage('dealer', calc.make_dealer_dict, [calc.dealer])
+
+    if groups is None:
+        groups = len(DEALER_CODE)
+    tasks = [ (group, calc.dealer, calc.rules, calc.kernels.name)
+        for group in dealer_groups(groups) ]
+
+    # build all the columns in the pool and merge them
+    def make_ev_tables():
+        if pool is not None:
+            results = pool.map(make_columns, tasks)
+        else:
+            with Pool(workers) as new_pool:
+                results = new_pool.map(make_columns, tasks)
+        for columns in results:
+            merge_columns(calc, columns)
+
+    stage('columns', make_ev_tables, *calc.ev_grids())
+    stage('publish', calc.publish_ev_tables)
+
+    stage('advantage', calc.make_advantage)
+    calc.recorder.finish(calc)
+    return calc.results()
+
+#
+# Prints the speedup of calculate() over the serial calculation for
+# 1..max_workers processes (best of repeat runs, pool start-up excluded)
+#
+def benchmark(max_workers, repeat=3):
+    def best(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    serial = best(calculate_serial)
+    print("serial: %.4fs"%serial)
+    for workers in range(1, max_workers + 1):
+        with Pool(workers) as pool:
+            elapsed = best(lambda: calculate(workers, pool=pool))
+        print("%2d worker(s): %.4fs  speedup %.2fx"%(workers, elapsed, serial/elapsed))
+
+if __name__ == "__main__":
+    import os
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count())
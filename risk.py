@@ -0,0 +1,439 @@
+#!/usr/bin/python3
+#
+# risk.py
+#
+# Strategies maximising a risk-averse objective (mean-variance or the
+# certainty equivalent of an exponential utility) instead of the EV
+#
+# An objective needs the whole outcome distribution of each action, so the
+# stand, hit, double and split recursions carry distributions of the net
+# result instead of EVs. As in outcome.py every distribution is conditional
+# on the dealer's final score, which all the hands of a split share: given
+# it the hands are independent and a split is a convolution of hands.
+# Distributions are vectors over the net results -MAX_UNITS to MAX_UNITS
+# (whole units: surrender and blackjack only happen on the initial hand).
+#
+# Every decision of the recursions (hitting again, the play of a split
+# hand, the first action) takes the continuation with the best score. For
+# the certainty equivalent the score is the objective itself. The variance
+# of a round does not split into the variances of its cells, so mean-variance
+# decisions score the expected utility (1 + 2 lam m) X - lam X^2 instead, the
+# linearisation of mean - lam * variance at the round's mean m: every
+# strategy that maximises the round's objective maximises that utility at
+# its own mean, and solving again at the new mean never lowers the
+# objective, so the solution is iterated to a fixed point of m. (The hands
+# of a split are still scored one by one, leaving out the covariance of
+# their results.)
+#
+# Several objectives are solved in one pass over the hands, sharing the
+# distributions that do not depend on the objective (standing, doubling,
+# split aces and the dealer's).
+#
+
+import math
+import time
+
+import codes
+import easybj
+from codes import BUST, FINAL_SCORES, NEXT, TWENTY_ONE
+from easybj import DEALER_CODE, INITIAL_CODE, PLAYER_CODE, card_probabilities, double_labels, make_rules
+from outcome import accumulate, payoff
+from table import Table
+
+# largest loss or win of a round in units (four split hands, all doubled)
+MAX_UNITS = 8
+
+# net results of the distribution vectors
+UNITS = list(range(-MAX_UNITS, MAX_UNITS + 1))
+
+# number of dealer final scores
+NUM_FINAL = len(FINAL_SCORES)
+
+#
+# Maximises mean - lam * variance
+#
+class MeanVariance:
+    def __init__(self, lam=0.):
+        self.lam = lam
+
+    def __call__(self, values, probs):
+        mean = sum(x*p for x, p in zip(values, probs))
+        square = sum(x*x*p for x, p in zip(values, probs))
+        return mean - self.lam*(square - mean*mean)
+
+    # the expected utility that linearises the objective at a mean
+    def linearized(self, mean):
+        return Quadratic(1 + 2*self.lam*mean, self.lam)
+
+    def __repr__(self):
+        return "mean_variance(%g)"%self.lam
+
+#
+# Expected utility a X - lam X^2
+#
+class Quadratic:
+    def __init__(self, a, lam):
+        self.a = a
+        self.lam = lam
+
+    def __call__(self, values, probs):
+        return sum((self.a - self.lam*x)*x*p for x, p in zip(values, probs))
+
+#
+# Maximises the certainty equivalent of an exponential utility with the
+# given absolute risk aversion (per unit bet): -log(E[exp(-a X)]) / a
+#
+class CertaintyEquivalent:
+    def __init__(self, aversion):
+        self.aversion = aversion
+
+    def __call__(self, values, probs):
+        a = self.aversion
+        if a == 0.:
+            return sum(x*p for x, p in zip(values, probs))
+        return -math.log(sum(p*math.exp(-a*x) for x, p in zip(values, probs) if p > 0.))/a
+
+    def __repr__(self):
+        return "certainty_equivalent(%g)"%self.aversion
+
+# objectives by name
+OBJECTIVES = {
+    'ev' : lambda: MeanVariance(0.),
+    'mean_variance' : MeanVariance,
+    'certainty_equivalent' : CertaintyEquivalent,
+}
+
+#
+# Returns the objective of a name, (name, parameter) or callable (taking
+# the values and probabilities of a distribution)
+#
+def make_objective(objective):
+    if callable(objective):
+        return objective
+    if isinstance(objective, str):
+        return OBJECTIVES[objective]()
+    name, parameter = objective
+    return OBJECTIVES[name](parameter)
+
+# a distribution vector of a single net result
+def unit(x):
+    vector = [0.]*len(UNITS)
+    vector[x + MAX_UNITS] = 1.
+    return vector
+
+# adds weight * b into vector a
+def add(a, b, weight=1.):
+    for i, p in enumerate(b):
+        a[i] += weight*p
+    return a
+
+#
+# Returns the distribution vector of the sum of two independent results
+#
+def convolve(a, b):
+    result = [0.]*len(UNITS)
+    nonzero = [ (j, q) for j, q in enumerate(b) if q ]
+    for i, p in enumerate(a):
+        if p:
+            for j, q in nonzero:
+                result[i + j - MAX_UNITS] += p*q
+    return result
+
+# per dealer final score: convolution, sum and scaling of conditional
+# distributions
+def convolve_each(a, b):
+    return [ convolve(x, y) for x, y in zip(a, b) ]
+
+def add_each(a, b, weight=1.):
+    for x, y in zip(a, b):
+        add(x, y, weight)
+    return a
+
+def zeros():
+    return [ [0.]*len(UNITS) for _ in range(NUM_FINAL) ]
+
+#
+# Solves the strategy of each of a list of objectives from the results of
+# easybj.calculate() (their initial table and dealer distributions)
+#
+# rules: the rules the results were calculated with
+#
+class RiskModel:
+    def __init__(self, results, objectives, rules=None):
+        self.results = results
+        self.objectives = [ make_objective(objective) for objective in objectives ]
+        # what the decisions of each objective maximise (see solve())
+        self.scores = list(self.objectives)
+        self.rules = make_rules(rules)
+        self.card_prob = card_probabilities(self.rules)
+        self.doubles = set(codes.codes(double_labels(self.rules)))
+        self.resplits = self.rules['split_hands'] - 2
+        self.dealprob = {}
+        for dc in DEALER_CODE:
+            dist = results['dealer'][dc]
+            self.dealprob[dc] = [ dist.get(str(d), 0.) for d in FINAL_SCORES ]
+        # conditional distributions shared by all the objectives, and lists
+        # of them by objective
+        self._stand = {}
+        self._double = {}
+        self._hit = {}
+        self._more = {}
+        self._base = {}
+        self._split = {}
+
+    # the unconditional distribution of conditional ones against dc
+    def mix(self, cond, dc):
+        result = [0.]*len(UNITS)
+        for p, vector in zip(self.dealprob[dc], cond):
+            add(result, vector, p)
+        return result
+
+    # the value of objective k of conditional distributions against dc
+    def score(self, k, cond, dc):
+        return self.scores[k](UNITS, self.mix(cond, dc))
+
+    # standing on hand code pc
+    def stand(self, pc):
+        if pc not in self._stand:
+            t = codes.score(pc)
+            self._stand[pc] = [ unit(int(payoff(t, d))) for d in FINAL_SCORES ]
+        return self._stand[pc]
+
+    # doubling down on hand code pc
+    def double(self, pc):
+        if pc not in self._double:
+            result = zeros()
+            for card, next_pc in enumerate(NEXT[pc]):
+                t = codes.score(next_pc)
+                add_each(result, [ unit(2*int(payoff(t, d))) for d in FINAL_SCORES ],
+                    self.card_prob[card])
+            self._double[pc] = result
+        return self._double[pc]
+
+    # [by objective] hitting once then playing on (hitting again while it
+    # scores better than standing)
+    def hit(self, pc, dc):
+        key = (pc, dc)
+        if key not in self._hit:
+            result = [ zeros() for _ in self.objectives ]
+            for card, next_pc in enumerate(NEXT[pc]):
+                p = self.card_prob[card]
+                for k, cond in enumerate(self.play_on(next_pc, dc)):
+                    add_each(result[k], cond, p)
+            self._hit[key] = result
+        return self._hit[key]
+
+    # [by objective] the best of standing and hitting on a hand already hit
+    def play_on(self, pc, dc):
+        key = (pc, dc)
+        if key not in self._more:
+            if pc == BUST or pc == TWENTY_ONE:
+                result = [ self.stand(pc) ]*len(self.objectives)
+            else:
+                stand = self.stand(pc)
+                result = []
+                for k, hit in enumerate(self.hit(pc, dc)):
+                    better = self.score(k, hit, dc) > self.score(k, stand, dc)
+                    result.append(hit if better else stand)
+            self._more[key] = result
+        return self._more[key]
+
+    # [by objective] a split hand that may not split again: the best of
+    # standing, hitting and doubling (21 stands)
+    def base(self, pc, dc):
+        key = (pc, dc)
+        if key not in self._base:
+            stand = self.stand(pc)
+            if pc == TWENTY_ONE:
+                result = [stand]*len(self.objectives)
+            else:
+                result = []
+                for k, hit in enumerate(self.hit(pc, dc)):
+                    s, h = self.score(k, stand, dc), self.score(k, hit, dc)
+                    db = float('-inf')
+                    if pc in self.doubles:
+                        double = self.double(pc)
+                        db = self.score(k, double, dc)
+                    result.append(stand if s >= max(h, db) else (hit if h >= db else double))
+            self._base[key] = result
+        return self._base[key]
+
+    # [by objective] the split hands of pair card x with the given number of
+    # resplits left (mirrors OutcomeModel.split_hands())
+    def split(self, x, dc, resplits=None):
+        if resplits is None:
+            resplits = self.resplits
+        key = (x, dc, resplits)
+        if key in self._split:
+            return self._split[key]
+        one = codes.one_card(x)
+        result = []
+        if x == 1:
+            hand = zeros()
+            for card, next_pc in enumerate(NEXT[one]):
+                add_each(hand, self.stand(next_pc), self.card_prob[card])
+            result = [convolve_each(hand, hand)]*len(self.objectives)
+        elif resplits == 0:
+            for k in range(len(self.objectives)):
+                hand = zeros()
+                for card, next_pc in enumerate(NEXT[one]):
+                    add_each(hand, self.base(next_pc, dc)[k], self.card_prob[card])
+                result.append(convolve_each(hand, hand))
+        else:
+            px = self.card_prob[x-1]
+            again = self.split(x, dc, resplits-1)
+            for k in range(len(self.objectives)):
+                other = zeros()
+                for card, next_pc in enumerate(NEXT[one]):
+                    if card + 1 != x:
+                        add_each(other, self.base(next_pc, dc)[k], self.card_prob[card])
+                # exactly one hand receives x, both do, or neither does
+                cond = add_each(zeros(), convolve_each(again[k], other), 2*px)
+                if resplits == 1:
+                    both = convolve_each(again[k], self.base(NEXT[one][x-1], dc)[k])
+                else:
+                    both = self.split(x, dc, 0)[k]
+                    both = convolve_each(both, both)
+                add_each(cond, both, px*px)
+                add_each(cond, convolve_each(other, other))
+                result.append(cond)
+        self._split[key] = result
+        return result
+
+    #
+    # Returns [(action, conditional distributions or None for surrender,
+    # value)] of the first actions of initial cell (pc, dc) for objective k
+    #
+    def actions(self, k, pc, dc):
+        code = codes.CODE[pc]
+        pair = codes.is_pair(code)
+        # a pair that is not split is played as its total
+        total = codes.hand(codes.points(code)) if pair and not codes.is_soft(code) else code
+        candidates = []
+        if pair and self.resplits >= 0:
+            candidates.append(('P', self.split(codes.pair_card(code), dc)[k]))
+        candidates += [ ('S', self.stand(total)), ('H', self.hit(total, dc)[k]) ]
+        if total in self.doubles:
+            candidates.append(('D', self.double(total)))
+        result = [ (action, cond, self.score(k, cond, dc)) for action, cond in candidates ]
+        if self.rules['surrender']:
+            surrender = self.rules['surrender_value']
+            result.append(('R', None, self.scores[k]([surrender], [1.])))
+        return result
+
+    #
+    # Returns for each objective a dictionary of:
+    #
+    #   strategy: Table of the best first actions (letters as in the
+    #     results of easybj.calculate())
+    #   optimal: Table of the score of the best first action (the expected
+    #     utility at the round's mean for mean-variance)
+    #   distribution: net distribution of a round (dict value -> probability)
+    #   advantage: EV of a round
+    #   variance: variance of a round
+    #   objective: the objective of a round
+    #   iterations: number of solutions at a new mean (1 when no objective
+    #     is mean-variance)
+    #
+    # Mean-variance starts at the mean of the EV strategy and solves again at
+    # the mean of each solution until the mean no longer changes.
+    #
+    def solve(self, max_iterations=100):
+        means = [ self.results['advantage'] ]*len(self.objectives)
+        for iterations in range(1, max_iterations + 1):
+            self.scores = [ objective.linearized(m) if isinstance(objective, MeanVariance)
+                else objective for objective, m in zip(self.objectives, means) ]
+            # the decisions depend on the scores
+            self._hit, self._more, self._base, self._split = {}, {}, {}, {}
+            solutions = self.solve_once()
+            previous, means = means, [ solution['advantage'] for solution in solutions ]
+            if not any(isinstance(objective, MeanVariance) for objective in self.objectives) \
+                    or means == previous:
+                break
+        for solution in solutions:
+            solution['iterations'] = iterations
+        return solutions
+
+    # the solutions of the current scores (see solve())
+    def solve_once(self):
+        initprob = self.results['initial']
+        blackjack = self.rules['blackjack']
+        solutions = []
+        for k, objective in enumerate(self.objectives):
+            strategy = Table(str, DEALER_CODE, PLAYER_CODE)
+            optimal = Table(float, DEALER_CODE, PLAYER_CODE)
+            distribution = {}
+            for dc in DEALER_CODE:
+                for pc in PLAYER_CODE:
+                    actions = self.actions(k, pc, dc)
+                    best = actions[0]
+                    for candidate in actions[1:]:
+                        if candidate[2] > best[2]:
+                            best = candidate
+                    action = best[0]
+                    if action in ('D', 'R'):
+                        # doubling and surrendering also tell the best of
+                        # standing and hitting
+                        values = { a:value for a, cond, value in actions }
+                        action += 's' if values['S'] >= values['H'] else 'h'
+                    strategy[pc,dc] = action
+                    optimal[pc,dc] = best[2]
+                    if pc not in INITIAL_CODE or initprob[pc,dc] <= 0.:
+                        continue
+                    if best[1] is None:
+                        dist = { self.rules['surrender_value']: 1. }
+                    else:
+                        dist = dict(zip(UNITS, self.mix(best[1], dc)))
+                    accumulate(distribution, dist, initprob[pc,dc])
+            for dc in DEALER_CODE + ['BJ']:
+                p = initprob['BJ',dc]
+                accumulate(distribution, { 0. if dc == 'BJ' else blackjack: 1. }, p)
+                if dc == 'BJ':
+                    for pc in INITIAL_CODE:
+                        if pc != 'BJ':
+                            accumulate(distribution, { -1.: 1. }, initprob[pc,dc])
+            values, probs = zip(*sorted(distribution.items()))
+            mean = sum(x*p for x, p in zip(values, probs))
+            solutions.append({
+                'strategy' : strategy,
+                'optimal' : optimal,
+                'distribution' : distribution,
+                'advantage' : mean,
+                'variance' : sum(x*x*p for x, p in zip(values, probs)) - mean*mean,
+                'objective' : objective(values, probs),
+            })
+        return solutions
+
+#
+# Returns the results of easybj.calculate() with the strategy, optimal
+# table and advantage of the objective (the EV tables stay those of the EV
+# strategy), and the variance and objective of a round
+#
+def calculate(objective, workers=None, rules=None, backend='python'):
+    results = easybj.calculate(workers, rules=rules, backend=backend)
+    solution = RiskModel(results, [objective], rules).solve()[0]
+    results.update({ name:solution[name] for name in
+        ('strategy', 'optimal', 'advantage', 'variance', 'objective') })
+    return results
+
+#
+# Returns the mean-variance frontier: for each lam, a dictionary of lam and
+# the solution of mean - lam * variance (see RiskModel.solve()), all the
+# lams solved in one pass
+#
+def frontier(lams, rules=None, backend='python'):
+    results = easybj.calculate(rules=rules, backend=backend)
+    solutions = RiskModel(results, [ MeanVariance(lam) for lam in lams ], rules).solve()
+    return [ dict(solution, lam=lam) for lam, solution in zip(lams, solutions) ]
+
+if __name__ == "__main__":
+    lams = [ i/20 for i in range(11) ]
+    start = time.perf_counter()
+    points = frontier(lams)
+    elapsed = time.perf_counter() - start
+    base = points[0]['strategy']
+    print("mean-variance frontier of %d lambdas in %.2fs"%(len(lams), elapsed))
+    for point in points:
+        changed = sum(point['strategy'][y,x] != base[y,x] for y in base.ylabels for x in base.xlabels)
+        print("lambda %.2f: EV %+.4f%%, sd %.4f, %d cells differ from the EV strategy"%(
+            point['lam'], point['advantage']*100, math.sqrt(point['variance']), changed))
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+#
+# search.py
+#
+# Finds the rule sets of a discrete rule space whose advantage lands in a
+# target range, calculating as few of them as possible
+#
+# Two facts keep the number of calculations down:
+#
+#   - the strategy does not depend on the blackjack payout, so the advantage
+#     is linear in it and one calculation serves every payout
+#   - a rule that only adds options for the player (surrender, doubling,
+#     splitting) can only raise the advantage, so the worst and best values
+#     of the rules not yet fixed bound every rule set below a branch
+#
+# The number of decks is not a dimension: the calculator never removes the
+# cards it deals, so n full decks weigh the cards like the infinite shoe.
+# Other compositions can be searched through the 'cards' rule.
+#
+
+import json
+import time
+
+import easybj
+from easybj import make_rules
+
+# values of the rules that only add options for the player, from the worst
+# to the best for the player
+MONOTONE = {
+    'surrender' : [False, True],
+    'split_hands' : [1, 2, 3, 4],
+    'double' : ['10-11', '9-11', 'any'],
+}
+
+# default rule space
+SPACE = {
+    'blackjack' : [1., 1.2, 1.5],
+    'surrender' : [False, True],
+    'split_hands' : [1, 2, 3, 4],
+    'double' : ['10-11', '9-11', 'any'],
+    'hit_soft17' : [True, False],
+}
+
+#
+# Searches a rule space: { rule name: [values] }. Rules of the space listed
+# in monotone are bounded by their worst and best values; the others are
+# enumerated.
+#
+# rules: values of the rules outside the space
+#
+class RuleSearch:
+    def __init__(self, space=SPACE, rules=None, monotone=MONOTONE, backend='python'):
+        make_rules(space)
+        self.base = make_rules(rules)
+        self.backend = backend
+        self.payouts = sorted(space.get('blackjack', [self.base['blackjack']]))
+        self.monotone = {}
+        self.enumerated = {}
+        for name, values in space.items():
+            if name == 'blackjack':
+                continue
+            if name in monotone:
+                order = monotone[name]
+                self.monotone[name] = sorted(values, key=order.index)
+            else:
+                self.enumerated[name] = list(values)
+
+        # (advantage, payout, weight of the payout) by rule set without the
+        # payout, shared by every branch that needs the same rule set
+        self.memo = {}
+        self.calculations = 0
+        self.pruned = 0
+
+    # number of rule sets in the space
+    def size(self):
+        size = len(self.payouts)
+        for values in list(self.monotone.values()) + list(self.enumerated.values()):
+            size *= len(values)
+        return size
+
+    #
+    # Returns the advantage of a rule set, calculating it only once for all
+    # the blackjack payouts
+    #
+    def advantage(self, rules):
+        rules = dict(self.base, **rules)
+        payout = rules.pop('blackjack')
+        key = json.dumps(rules, sort_keys=True)
+        if key not in self.memo:
+            results = easybj.calculate(rules=dict(rules, blackjack=payout), backend=self.backend)
+            initial = results['initial']
+            # probability of a blackjack paid at the payout
+            weight = sum(initial['BJ',dc] for dc in easybj.DEALER_CODE)
+            self.memo[key] = (results['advantage'], payout, weight)
+            self.calculations += 1
+        advantage, base, weight = self.memo[key]
+        return advantage + (payout - base)*weight
+
+    #
+    # Returns [(rules, advantage)] of the rule sets with an advantage within
+    # [lo, hi], by advantage
+    #
+    def search(self, lo, hi):
+        found = []
+        names = list(self.enumerated) + list(self.monotone)
+
+        def payouts(fixed):
+            for payout in self.payouts:
+                rules = dict(fixed, blackjack=payout)
+                advantage = self.advantage(rules)
+                if lo <= advantage <= hi:
+                    found.append((rules, advantage))
+
+        def visit(fixed, rest):
+            if not rest:
+                payouts(fixed)
+                return
+            if rest[0] not in self.enumerated:
+                # every rule left is monotone: bound the whole branch
+                worst = dict(fixed, blackjack=self.payouts[0])
+                best = dict(fixed, blackjack=self.payouts[-1])
+                for name in rest:
+                    worst[name] = self.monotone[name][0]
+                    best[name] = self.monotone[name][-1]
+                if self.advantage(best) < lo or self.advantage(worst) > hi:
+                    size = len(self.payouts)
+                    for name in rest:
+                        size *= len(self.monotone[name])
+                    self.pruned += size
+                    return
+            name = rest[0]
+            values = self.enumerated[name] if name in self.enumerated else self.monotone[name]
+            for value in values:
+                visit(dict(fixed, **{ name:value }), rest[1:])
+
+        visit({}, names)
+        found.sort(key=lambda item: item[1])
+        return found
+
+#
+# Returns [(rules, advantage)] of the rule sets of the space whose advantage
+# is within tolerance of the target, and the search that found them
+#
+def search(target, tolerance, space=SPACE, rules=None, monotone=MONOTONE):
+    rule_search = RuleSearch(space, rules, monotone)
+    return rule_search.search(target - tolerance, target + tolerance), rule_search
+
+#
+# python3 search.py [TARGET% [TOLERANCE%]]
+#
+def main(argc, argv):
+    target = float(argv[1])/100 if argc > 1 else 0.10
+    tolerance = float(argv[2])/100 if argc > 2 else 0.005
+    start = time.perf_counter()
+    found, rule_search = search(target, tolerance)
+    elapsed = time.perf_counter() - start
+    for rules, advantage in found:
+        print("%+.4f%%  %s"%(advantage*100, json.dumps(rules, sort_keys=True)))
+    print("%d rule set(s) found among %d, %d calculation(s), %d pruned, %.2fs"%(
+        len(found), rule_search.size(), rule_search.calculations, rule_search.pruned, elapsed))
+
+if __name__ == "__main__":
+    import sys
+    main(len(sys.argv), sys.argv)
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+#
+# sidebet.py
+#
+# Prices side bets on the initial deal from rank/suit counts of the shoe
+#
+
+from easybj import POINT_MAP
+
+# all ranks and suits of a French deck
+RANKS = [ 'A', '2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K' ]
+SUITS = [ 'S', 'H', 'D', 'C' ]
+
+# suits of each color
+RED = [ 'H', 'D' ]
+BLACK = [ 'S', 'C' ]
+
+# ranks worth 10 points
+TEN_RANKS = [ 'T', 'J', 'Q', 'K' ]
+
+# runs of three ranks counted as straights (ace plays high or low)
+STRAIGHTS = [ RANKS[i:i+3] for i in range(11) ] + [ [ 'Q', 'K', 'A' ] ]
+
+# default paytables (payout per unit bet for each winning category)
+PAYTABLES = {
+    'perfect_pairs' : { 'perfect' : 25, 'colored' : 12, 'mixed' : 6 },
+    '21+3' : { 'suited_trips' : 100, 'straight_flush' : 40, 'trips' : 30,
+        'straight' : 10, 'flush' : 5 },
+    'lucky_ladies' : { 'queen_hearts_bj' : 1000, 'queen_hearts' : 125,
+        'matched' : 19, 'suited' : 9, 'any' : 4 },
+    'buster' : { 3 : 1, 4 : 2, 5 : 9, 6 : 50, 7 : 100, 8 : 250 },
+}
+
+#
+# A shoe of rank/suit counts. An infinite shoe keeps the composition of a
+# single deck, and draws never deplete it.
+#
+class Shoe:
+    def __init__(self, decks=None):
+        self.decks = decks
+        n = 1 if decks is None else decks
+        self.counts = { r:{ s:n for s in SUITS } for r in RANKS }
+
+    # whether drawing a card depletes the shoe
+    def finite(self):
+        return self.decks is not None
+
+    # number of cards of a rank (and suit)
+    def count(self, rank, suit=None):
+        if suit is not None:
+            return self.counts[rank][suit]
+        return sum(self.counts[rank].values())
+
+    # total number of cards in the shoe
+    def total(self):
+        return sum(self.count(r) for r in RANKS)
+
+    # number of ordered ways to draw k cards out of n identical ones
+    # (multinomial counting for a finite shoe, n**k for an infinite one)
+    def ways(self, n, k):
+        if not self.finite():
+            return n**k
+        result = 1
+        for i in range(k):
+            result *= n - i
+        return result
+
+    # probability of a draw counted in ways() out of k cards
+    def prob(self, ways, k):
+        return ways/self.ways(self.total(), k)
+
+    # number of cards per point value (ace as 11), for the dealer recursion
+    def values(self):
+        result = {}
+        for r in RANKS:
+            v = POINT_MAP[r]
+            result[v] = result.get(v, 0) + self.count(r)
+        return result
+
+#
+# Returns the probability of each Perfect Pairs category (player's two cards)
+#
+def perfect_pairs(shoe):
+    perfect = colored = mixed = 0
+    for r in RANKS:
+        for s in SUITS:
+            perfect += shoe.ways(shoe.count(r, s), 2)
+        for color in (RED, BLACK):
+            colored += 2*shoe.count(r, color[0])*shoe.count(r, color[1])
+        mixed += 2*sum(shoe.count(r, a)*shoe.count(r, b) for a in RED for b in BLACK)
+    return {
+        'perfect' : shoe.prob(perfect, 2),
+        'colored' : shoe.prob(colored, 2),
+        'mixed' : shoe.prob(mixed, 2),
+    }
+
+#
+# Returns the probability of each 21+3 category (player's two cards plus
+# the dealer's up card, as a three-card poker hand)
+#
+def twenty_one_plus_three(shoe):
+    suited_trips = trips = flush = 0
+    for r in RANKS:
+        trips += shoe.ways(shoe.count(r), 3)
+        for s in SUITS:
+            suited_trips += shoe.ways(shoe.count(r, s), 3)
+    for s in SUITS:
+        flush += shoe.ways(sum(shoe.count(r, s) for r in RANKS), 3)
+    straight = straight_flush = 0
+    for a, b, c in STRAIGHTS:
+        straight += 6*shoe.count(a)*shoe.count(b)*shoe.count(c)
+        for s in SUITS:
+            straight_flush += 6*shoe.count(a, s)*shoe.count(b, s)*shoe.count(c, s)
+    return {
+        'suited_trips' : shoe.prob(suited_trips, 3),
+        'straight_flush' : shoe.prob(straight_flush, 3),
+        'trips' : shoe.prob(trips - suited_trips, 3),
+        'straight' : shoe.prob(straight - straight_flush, 3),
+        'flush' : shoe.prob(flush - straight_flush - suited_trips, 3),
+    }
+
+#
+# Returns the probability of each Lucky Ladies category (player's two cards
+# totaling 20, with the top award requiring a dealer blackjack)
+#
+def lucky_ladies(shoe):
+    queens = shoe.count('Q', 'H')
+    tens = sum(shoe.count(r) for r in TEN_RANKS)
+    aces = shoe.count('A')
+    qh_pair = shoe.ways(queens, 2)
+    # dealer blackjack after the two queens of hearts left the shoe
+    if shoe.finite():
+        dealer_bj = 2*aces*(tens - 2)/shoe.ways(shoe.total() - 2, 2)
+    else:
+        dealer_bj = 2*aces*tens/shoe.ways(shoe.total(), 2)
+    matched = sum(shoe.ways(shoe.count(r, s), 2) for r in TEN_RANKS for s in SUITS)
+    suited = 0
+    for s in SUITS:
+        suited += 2*shoe.count('A', s)*shoe.count('9', s)
+        suited += shoe.ways(sum(shoe.count(r, s) for r in TEN_RANKS), 2)
+    total = 2*aces*shoe.count('9') + shoe.ways(tens, 2)
+    return {
+        'queen_hearts_bj' : shoe.prob(qh_pair, 2)*dealer_bj,
+        'queen_hearts' : shoe.prob(qh_pair, 2)*(1 - dealer_bj),
+        'matched' : shoe.prob(matched - qh_pair, 2),
+        'suited' : shoe.prob(suited - matched, 2),
+        'any' : shoe.prob(total - suited, 2),
+    }
+
+#
+# Returns the probability that the dealer busts with each number of cards
+# (hands of 8 or more cards are counted as 8). The dealer hits soft 17, like
+# the dealer tables of easybj.
+#
+def buster(shoe):
+    counts = shoe.values()
+    order = sorted(counts)
+    memo = {}
+
+    # distribution of the bust card count from a dealer hand
+    def draw(left, points, soft, ncards):
+        if points > 21:
+            return { min(ncards, 8): 1. }
+        if points > 17 or (points == 17 and not soft):
+            return {}
+        key = (left, points, soft, ncards)
+        if key in memo:
+            return memo[key]
+        total = sum(left)
+        result = {}
+        for i, v in enumerate(order):
+            if left[i] == 0:
+                continue
+            p = left[i]/total
+            if shoe.finite():
+                rest = left[:i] + (left[i] - 1,) + left[i+1:]
+            else:
+                rest = left
+            new_points, new_soft = points + v, soft
+            if v == 11:
+                if soft:
+                    new_points -= 10
+                new_soft = True
+            if new_points > 21 and new_soft:
+                new_points -= 10
+                new_soft = False
+            for n, q in draw(rest, new_points, new_soft, ncards + 1).items():
+                result[n] = result.get(n, 0.) + p*q
+        memo[key] = result
+        return result
+
+    return draw(tuple(counts[v] for v in order), 0, False, 0)
+
+# side bets priced by this module
+BETS = {
+    'perfect_pairs' : perfect_pairs,
+    '21+3' : twenty_one_plus_three,
+    'lucky_ladies' : lucky_ladies,
+    'buster' : buster,
+}
+
+#
+# Returns the expected value per unit of a side bet together with the
+# probability of each of its winning categories
+#
+# bet: one of the keys of BETS
+# paytable: payout per category (defaults to PAYTABLES[bet])
+# shoe: Shoe to deal from (defaults to an infinite shoe)
+#
+def price(bet, paytable=None, shoe=None):
+    if bet not in BETS:
+        raise KeyError("%s is not a known side bet"%bet)
+    if paytable is None:
+        paytable = PAYTABLES[bet]
+    if shoe is None:
+        shoe = Shoe()
+    probs = BETS[bet](shoe)
+    win = sum(probs.values())
+    ev = sum(p*paytable.get(k, 0) for k, p in probs.items()) - (1 - win)
+    return { 'ev' : ev, 'probabilities' : probs }
+
+if __name__ == "__main__":
+    import sys
+    decks = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    for bet in BETS:
+        print("%-14s EV: %+.4f%%"%(bet, price(bet, shoe=Shoe(decks))['ev']*100))
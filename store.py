@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+#
+# store.py
+#
+# Indexed SQLite store for the results of many rule configurations
+#
+# Each EV and strategy table of a rule set is one row holding its cells
+# packed in a fixed layout (little-endian doubles, NaN for an empty cell;
+# two ASCII letters per strategy cell), and a query for one cell reads its
+# bytes with substr(). The initial probabilities, the dealer distributions
+# and the resplit tables are not stored: they are intermediate results a
+# calculation from the rules gives back.
+#
+# flush() writes all the queued rule sets with one executemany per table,
+# and a batch at least as large as the store is written before the index
+# on the advantage is built.
+#
+
+import json
+import math
+import sqlite3
+import struct
+
+from easybj import DEALER_CODE, NON_SPLIT_CODE, PLAYER_CODE, SPLIT_CODE, STAND_CODE, make_rules
+
+# result tables kept in the store, with the player labels of their rows
+# (every table has a column per dealer label of DEALER_CODE)
+TABLES = [ 'stand', 'hit', 'double', 'split', 'optimal', 'strategy' ]
+ROWS = {
+    'stand' : STAND_CODE,
+    'hit' : NON_SPLIT_CODE,
+    'double' : NON_SPLIT_CODE,
+    'split' : SPLIT_CODE,
+    'optimal' : PLAYER_CODE,
+    'strategy' : PLAYER_CODE,
+}
+
+# id of each table name in the grids table
+TABLE_ID = { name:i for i, name in enumerate(TABLES) }
+
+# bytes of a cell of each table (strategy cells are action letters)
+CELL_SIZE = { name:2 if name == 'strategy' else 8 for name in TABLES }
+
+# position of each cell in the packed grid of each table
+POSITION = { name:{ (y, x):i*len(DEALER_CODE) + j for i, y in enumerate(ROWS[name])
+    for j, x in enumerate(DEALER_CODE) } for name in TABLES }
+
+# version of the layout (stores of another version are refused)
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    advantage REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rules (
+    name TEXT NOT NULL,
+    value,
+    config_id INTEGER NOT NULL,
+    PRIMARY KEY (name, value, config_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS grids (
+    tbl INTEGER NOT NULL,
+    config_id INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (tbl, config_id)
+) WITHOUT ROWID;
+"""
+
+# index of the rule sets by advantage
+ADVANTAGE_INDEX = "CREATE INDEX IF NOT EXISTS configs_advantage ON configs (advantage)"
+
+#
+# Returns the canonical key of a rule set
+#
+def rules_key(rules):
+    return json.dumps(make_rules(rules), sort_keys=True)
+
+#
+# Returns a rule value as stored in SQLite (None and lists as JSON, since
+# the value is part of the rules table's primary key and may not be NULL)
+#
+def sql_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float, str)):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+#
+# Returns the cells of a table from easybj.calculate() packed in the layout
+# of the named table
+#
+def pack_grid(name, table):
+    rows = table.tabledict
+    if name == 'strategy':
+        return "".join((rows[y][x] or "").ljust(2) for y in ROWS[name] for x in DEALER_CODE).encode()
+    values = [ rows[y][x] for y in ROWS[name] for x in DEALER_CODE ]
+    return struct.pack("<%dd"%len(values), *(math.nan if v is None else v for v in values))
+
+# the value of a cell of a table from its packed bytes (None when empty)
+def unpack_cell(name, data):
+    if name == 'strategy':
+        return data.decode().strip() or None
+    value = struct.unpack("<d", data)[0]
+    return None if math.isnan(value) else value
+
+#
+# A result store backed by one SQLite file. Results are buffered by add()
+# and written by flush() in one transaction per batch.
+#
+class ResultStore:
+    def __init__(self, path, batch=100):
+        self.db = sqlite3.connect(path)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        tables = self.db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table'").fetchone()[0]
+        if tables and version != SCHEMA_VERSION:
+            self.db.close()
+            raise ValueError("%s is a store of version %d, not %d"%(path, version, SCHEMA_VERSION))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.execute(ADVANTAGE_INDEX)
+        self.db.execute("PRAGMA user_version=%d"%SCHEMA_VERSION)
+        self.batch = batch
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # queue the results of one rule set (flushed every `batch` results)
+    def add(self, rules, results):
+        self.pending.append((make_rules(rules), results))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    # add many (rules, results) pairs
+    def ingest(self, items):
+        for rules, results in items:
+            self.add(rules, results)
+        self.flush()
+
+    # write all the queued results (replacing rule sets already stored)
+    def flush(self):
+        if not self.pending:
+            return
+        # the last results queued for each rule set
+        latest = {}
+        for rules, results in self.pending:
+            latest[rules_key(rules)] = (rules, results)
+        with self.db:
+            stored = self.db.execute("SELECT COUNT(*) FROM configs").fetchone()[0]
+            old = [ (cid,) for key in latest
+                for cid, in self.db.execute("SELECT id FROM configs WHERE key=?", (key,)) ]
+            self.db.executemany("DELETE FROM configs WHERE id=?", old)
+            self.db.executemany("DELETE FROM rules WHERE config_id=?", old)
+            self.db.executemany("DELETE FROM grids WHERE tbl=? AND config_id=?",
+                [ (t, cid) for cid, in old for t in range(len(TABLES)) ])
+            first = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM configs").fetchone()[0]
+            configs = [ (cid, key, rules, results)
+                for cid, (key, (rules, results)) in enumerate(latest.items(), first) ]
+            # a batch as large as the store is cheaper to index afterwards
+            bulk = len(configs) >= stored
+            if bulk:
+                self.db.execute("DROP INDEX IF EXISTS configs_advantage")
+            self.db.executemany("INSERT INTO configs VALUES (?, ?, ?)",
+                [ (cid, key, results['advantage']) for cid, key, rules, results in configs ])
+            self.db.executemany("INSERT INTO rules VALUES (?, ?, ?)",
+                [ (name, sql_value(value), cid) for cid, key, rules, results in configs
+                    for name, value in rules.items() ])
+            self.db.executemany("INSERT INTO grids VALUES (?, ?, ?)",
+                [ (TABLE_ID[name], cid, pack_grid(name, results[name]))
+                    for cid, key, rules, results in configs for name in TABLES ])
+            if bulk:
+                self.db.execute(ADVANTAGE_INDEX)
+        self.pending = []
+
+    # SQL condition and parameters restricting configs.id to rule values
+    def _where_rules(self, rules):
+        clauses = []
+        params = []
+        for name, value in (rules or {}).items():
+            clauses.append("configs.id IN (SELECT config_id FROM rules WHERE name=? AND value=?)")
+            params += [ name, sql_value(value) ]
+        return clauses, params
+
+    # number of stored rule sets
+    def __len__(self):
+        self.flush()
+        return self.db.execute("SELECT COUNT(*) FROM configs").fetchone()[0]
+
+    #
+    # Returns [(rules, advantage)] of the rule sets whose advantage is within
+    # [lo, hi] and whose rules match the given values, by advantage
+    #
+    def configs(self, lo=float('-inf'), hi=float('inf'), **rules):
+        self.flush()
+        clauses, params = self._where_rules(rules)
+        sql = "SELECT key, advantage FROM configs WHERE advantage BETWEEN ? AND ?"
+        for clause in clauses:
+            sql += " AND " + clause
+        cur = self.db.execute(sql + " ORDER BY advantage", [lo, hi] + params)
+        return [ (json.loads(key), advantage) for key, advantage in cur ]
+
+    #
+    # Returns [(rules, value)] of one cell of a table across all the rule
+    # sets matching the given rule values
+    #
+    def cell(self, table, pc, dc, **rules):
+        self.flush()
+        clauses, params = self._where_rules(rules)
+        size = CELL_SIZE[table]
+        sql = "SELECT configs.key, substr(grids.data, ?, ?) FROM grids JOIN configs " \
+            "ON configs.id = grids.config_id WHERE tbl=?"
+        for clause in clauses:
+            sql += " AND " + clause
+        start = POSITION[table][pc,dc]*size + 1
+        cur = self.db.execute(sql, [ start, size, TABLE_ID[table] ] + params)
+        return [ (json.loads(key), value) for key, value in
+            ((key, unpack_cell(table, data)) for key, data in cur) if value is not None ]
+
+    #
+    # Returns where one cell changes value as a rule grows, with every other
+    # rule fixed: [(other rules, rule value below, value, rule value above,
+    # new value)]
+    #
+    def transitions(self, table, pc, dc, rule, **rules):
+        groups = {}
+        for config, value in self.cell(table, pc, dc, **rules):
+            x = config.pop(rule)
+            groups.setdefault(json.dumps(config, sort_keys=True), []).append((x, value))
+        result = []
+        for other, points in sorted(groups.items()):
+            points.sort(key=lambda point: point[0])
+            for (x0, v0), (x1, v1) in zip(points, points[1:]):
+                if v0 != v1:
+                    result.append((json.loads(other), x0, v0, x1, v1))
+        return result
@@ -0,0 +1,366 @@
+#!/usr/bin/python3
+#
+# sweep.py
+#
+# Distributed rule sweeps: a coordinator serves rule-set tasks over TCP to
+# workers on any node and appends finished results to a checkpoint journal,
+# so that a restarted sweep resumes where it stopped
+#
+# Workers take tasks one at a time from a task board in the coordinator's
+# manager process, which starts the lease of a task when a worker takes it.
+# A task whose lease runs out without a result goes back on the board (its
+# worker is presumed dead); a task still waiting on the board never expires.
+# A task whose calculation raises is recorded as failed rather than handed
+# out again.
+#
+# The manager exchanges pickles, so anyone holding its key can run code in
+# the coordinator and the workers: the key has no default and is read from
+# the EASYBJ_SWEEP_KEY environment variable on the command line.
+#
+
+import itertools
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+
+import easybj
+from table import Table
+
+# default address of the coordinator
+ADDRESS = ('127.0.0.1', 50515)
+
+# environment variable holding the key of the coordinator
+AUTHKEY_VARIABLE = 'EASYBJ_SWEEP_KEY'
+
+#
+# Returns the key of the coordinator from the environment (a ValueError
+# when it is not set)
+#
+def environment_authkey():
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    if not key:
+        raise ValueError("set %s to the key shared by the coordinator and its workers"%AUTHKEY_VARIABLE)
+    return key.encode()
+
+#
+# Returns every combination of the given rule choices as a list of rule sets
+# (e.g. rule_grid(blackjack=[1.2, 1.5], surrender=[True, False]))
+#
+def rule_grid(**choices):
+    names = sorted(choices)
+    return [ dict(zip(names, values))
+        for values in itertools.product(*(choices[n] for n in names)) ]
+
+# canonical key of a rule set
+def rules_key(rules):
+    return json.dumps(easybj.make_rules(rules), sort_keys=True)
+
+#
+# Returns a JSON serializable copy of a result dictionary
+#
+def dump_results(results):
+    dumped = {}
+    for name, result in results.items():
+        if isinstance(result, Table):
+            dumped[name] = result.to_dict()
+        elif name == 'resplit':
+            dumped[name] = [ table.to_dict() for table in result ]
+        elif name == 'dealer':
+            dumped[name] = { dc:dict(dist) for dc, dist in result.items() }
+        else:
+            dumped[name] = result
+    return dumped
+
+#
+# Rebuilds a result dictionary from dump_results()
+#
+def load_results(dumped):
+    results = {}
+    for name, result in dumped.items():
+        if name == 'resplit':
+            results[name] = [ Table.from_dict(d) for d in result ]
+        elif isinstance(result, dict) and 'cells' in result:
+            results[name] = Table.from_dict(result)
+        else:
+            results[name] = result
+    return results
+
+#
+# Returns { rules key: results } of all the results in a journal (failed
+# tasks are left out, to be tried again)
+#
+def read_journal(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash
+                continue
+            if 'results' in entry:
+                done[entry['key']] = load_results(entry['results'])
+    return done
+
+#
+# Tasks of a sweep, living in the coordinator's manager process (which
+# serves every worker from its own thread, hence the lock): the tasks
+# waiting for a worker and the leases of the tasks taken
+#
+class TaskBoard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = deque()
+        # (rules, start of the lease) by key of the tasks taken
+        self.leases = {}
+        self.finished = False
+
+    def put(self, key, rules):
+        with self.lock:
+            self.waiting.append((key, rules))
+
+    # hands out the next task and starts its lease (None when none waits)
+    def take(self):
+        with self.lock:
+            if not self.waiting:
+                return None
+            key, rules = self.waiting.popleft()
+            self.leases[key] = (rules, time.time())
+            return key, rules
+
+    # a task whose result arrived is no longer leased nor waiting
+    def complete(self, key):
+        with self.lock:
+            self.leases.pop(key, None)
+            self.waiting = deque(task for task in self.waiting if task[0] != key)
+
+    # puts the tasks leased for more than lease seconds back on the board
+    # and returns their keys
+    def expire(self, lease):
+        with self.lock:
+            now = time.time()
+            expired = [ key for key, (rules, start) in self.leases.items() if now - start > lease ]
+            for key in expired:
+                rules, start = self.leases.pop(key)
+                self.waiting.append((key, rules))
+            return expired
+
+    def done(self):
+        return self.finished
+
+    def finish(self):
+        self.finished = True
+
+# the board and the result queue of the coordinator's manager process
+_board = TaskBoard()
+_results = queue.Queue()
+
+def _get_board():
+    return _board
+
+def _get_results():
+    return _results
+
+class SweepManager(BaseManager):
+    pass
+
+SweepManager.register('board', callable=_get_board)
+SweepManager.register('results', callable=_get_results)
+
+#
+# Runs a sweep over the rule sets and returns ({ rules key: results },
+# { rules key: error } of the tasks whose calculation raised)
+#
+# journal: checkpoint file (JSON lines); rule sets already in it are skipped
+# authkey: key (bytes) the workers must present
+# lease: seconds after a worker took a task without a result before the
+#   task is handed out again (checked every poll seconds)
+# store: optional store.ResultStore receiving every new result
+#
+def coordinate(rule_sets, journal, authkey, address=ADDRESS,
+        lease=600., poll=0.5, store=None):
+    done = read_journal(journal)
+    failed = {}
+    pending = {}
+    for rules in rule_sets:
+        key = rules_key(rules)
+        if key not in done:
+            pending[key] = easybj.make_rules(rules)
+
+    manager = SweepManager(address=address, authkey=authkey)
+    manager.start()
+    try:
+        board, results = manager.board(), manager.results()
+        for key, rules in pending.items():
+            board.put(key, rules)
+        with open(journal, 'a') as f:
+            while pending:
+                board.expire(lease)
+                try:
+                    key, dumped, error = results.get(timeout=poll)
+                except queue.Empty:
+                    continue
+                board.complete(key)
+                if key not in pending:
+                    # a duplicate from a task that was handed out again
+                    continue
+                if error is None:
+                    entry = { 'key' : key, 'results' : dumped }
+                else:
+                    entry = { 'key' : key, 'error' : error }
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                if error is None:
+                    done[key] = load_results(dumped)
+                    if store is not None:
+                        store.add(pending[key], done[key])
+                else:
+                    failed[key] = error
+                del pending[key]
+        board.finish()
+        if store is not None:
+            store.flush()
+        # let idle workers notice the end of the sweep before shutting down
+        time.sleep(poll)
+    finally:
+        manager.shutdown()
+    return done, failed
+
+#
+# Connects to a coordinator, retrying for up to wait seconds while it starts
+#
+def connect(authkey, address=ADDRESS, wait=0., poll=0.5):
+    deadline = time.time() + wait
+    while True:
+        manager = SweepManager(address=address, authkey=authkey)
+        try:
+            manager.connect()
+            return manager
+        except ConnectionError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(poll)
+
+#
+# Runs a worker that takes rule sets from the coordinator until the sweep is
+# finished (or the coordinator goes away) and returns the number of tasks
+# (a task whose calculation raises is sent back with the error)
+#
+# wait: seconds to wait for the coordinator to start
+#
+def run_worker(authkey, address=ADDRESS, poll=0.5, wait=0.):
+    manager = connect(authkey, address, wait, poll)
+    board, results = manager.board(), manager.results()
+    count = 0
+    while True:
+        try:
+            task = board.take()
+            if task is None:
+                if board.done():
+                    return count
+                time.sleep(poll)
+                continue
+        except (EOFError, ConnectionError):
+            return count
+        key, rules = task
+        try:
+            results.put((key, dump_results(easybj.calculate(rules=rules)), None))
+        except Exception as e:
+            results.put((key, None, "%s: %s"%(type(e).__name__, e)))
+        count += 1
+
+#
+# Runs a sweep on localhost with a number of worker processes plus a worker
+# that takes a task and dies, and checks that every result arrives once the
+# dead worker's lease runs out and matches a direct calculation, and that a
+# rule set the calculation rejects is recorded as failed once. Returns the
+# seconds the sweep took.
+#
+def local_sweep(rule_sets, workers=3, address=('127.0.0.1', 50516), lease=2., poll=0.1):
+    authkey = os.urandom(32)
+    broken = easybj.make_rules({ 'double' : 'none of them' })
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = os.path.join(tmp, "journal.jsonl")
+        done, failed = {}, {}
+        def run():
+            results = coordinate(rule_sets + [broken], journal, authkey, address,
+                lease=lease, poll=poll)
+            done.update(results[0])
+            failed.update(results[1])
+        coordinator = threading.Thread(target=run)
+        start = time.perf_counter()
+        coordinator.start()
+        # the dead worker: a task taken and never returned
+        board = connect(authkey, address, wait=10., poll=poll).board()
+        task = board.take()
+        while task is None:
+            time.sleep(poll)
+            task = board.take()
+        lost = task[0]
+        processes = [ Process(target=run_worker, args=(authkey, address),
+            kwargs={ 'poll' : poll, 'wait' : 10. }) for _ in range(workers) ]
+        for process in processes:
+            process.start()
+        coordinator.join()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        if elapsed < lease:
+            raise AssertionError("the sweep ended before the lost task's lease ran out")
+        with open(journal) as f:
+            journaled = [ json.loads(line)['key'] for line in f ]
+        if sorted(journaled) != sorted(set(journaled)) or lost not in journaled:
+            raise AssertionError("the journal misses or repeats tasks")
+        if list(failed) != [rules_key(broken)] or rules_key(broken) in read_journal(journal):
+            raise AssertionError("the rejected rule set is not recorded as failed")
+    for rules in rule_sets:
+        results = done[rules_key(rules)]
+        if results['advantage'] != easybj.calculate(rules=rules)['advantage']:
+            raise AssertionError("%s differs from a direct calculation"%rules_key(rules))
+    return elapsed
+
+# grid of the local check
+LOCAL_GRID = { 'blackjack' : [1., 1.2, 1.5, 2.], 'surrender' : [True, False] }
+
+#
+# python3 sweep.py coordinator JOURNAL GRID [HOST PORT]
+# python3 sweep.py worker [HOST PORT]
+# python3 sweep.py local [WORKERS]
+#
+# GRID is a JSON object of the choices of each rule, for example
+# '{"blackjack": [1.2, 1.5], "cards": [null, [4,4,4,4,4,4,4,4,4,16]]}'.
+# The coordinator and the workers read their key from EASYBJ_SWEEP_KEY.
+#
+def main(argc, argv):
+    if argc >= 2 and argv[1] == 'local':
+        workers = int(argv[2]) if argc >= 3 else 3
+        grid = rule_grid(**LOCAL_GRID)
+        elapsed = local_sweep(grid, workers)
+        print("%d rule sets and a rejected one on %d local workers (one lost task) in %.1fs, all results match"%(
+            len(grid), workers, elapsed))
+    elif argc >= 2 and argv[1] == 'worker':
+        address = (argv[2], int(argv[3])) if argc >= 4 else ADDRESS
+        print("%d task(s) done"%run_worker(environment_authkey(), address))
+    elif argc >= 4 and argv[1] == 'coordinator':
+        address = (argv[4], int(argv[5])) if argc >= 6 else ADDRESS
+        grid = rule_grid(**json.loads(argv[3]))
+        done, failed = coordinate(grid, argv[2], environment_authkey(), address)
+        for key, results in sorted(done.items()):
+            print("%s: %2.4f%%"%(key, results['advantage']*100))
+        for key, error in sorted(failed.items()):
+            print("%s: failed: %s"%(key, error))
+    else:
+        print("usage: %s coordinator JOURNAL GRID [HOST PORT] | worker [HOST PORT] | local [WORKERS]"%argv[0])
+
+if __name__ == "__main__":
+    import sys
+    main(len(sys.argv), sys.argv)
@@ -5,7 +5,11 @@
 # Implements a two-dimension table where all cells must be of same type
 #
 
+import json
+import os
+import struct
 from collections.abc import Sized
+from multiprocessing import resource_tracker, shared_memory
 
 class Table:
     #
@@ -87,6 +91,338 @@ class Table:
         
         # TODO: implement me
         self.tabledict[row][col] = None
-    
-            
 
+    #
+    # Returns a plain dictionary (JSON serializable for str, int and float
+    # cells) that from_dict() turns back into an equal table
+    #
+    def to_dict(self):
+        return {
+            'celltype' : self.celltype.__name__,
+            'xlabels' : list(self.xlabels),
+            'ylabels' : list(self.ylabels),
+            'unit' : self.unit,
+            'cells' : [ [ self.tabledict[y][x] for x in self.xlabels ]
+                for y in self.ylabels ],
+        }
+
+    #
+    # Builds a table from the output of to_dict()
+    #
+    @classmethod
+    def from_dict(cls, d):
+        celltype = { 'str' : str, 'int' : int, 'float' : float }[d['celltype']]
+        table = cls(celltype, d['xlabels'], d['ylabels'], d['unit'])
+        for y, row in zip(table.ylabels, d['cells']):
+            for x, value in zip(table.xlabels, row):
+                if value is not None:
+                    table[y,x] = value
+        return table
+
+    #
+    # Returns an immutable snapshot of the table in one shared memory block
+    # (see FrozenTable)
+    #
+    # name: name of the block (chosen by the system when omitted)
+    #
+    def freeze(self, name=None):
+        return FrozenTable.create(self, name)
+
+# magic number and header length at the start of a frozen table's block
+HEADER = struct.Struct("<4sI")
+MAGIC = b"EBJT"
+
+# array type code and item size of the numeric cell types
+ARRAY_TYPE = { 'float' : ('d', 8), 'int' : ('q', 8) }
+
+# cell types by name
+CELLTYPES = { 'str' : str, 'int' : int, 'float' : float }
+
+#
+# Returns the identity of this process's resource tracker (None where shared
+# memory is not tracked): the pipe to the tracker, which the children of a
+# process share with it
+#
+def _tracker():
+    if os.name == 'nt':
+        return None
+    stat = os.fstat(resource_tracker.getfd())
+    return "%d:%d"%(stat.st_dev, stat.st_ino)
+
+# the header length and the JSON header of a block
+def _read_header(block):
+    magic, size = HEADER.unpack_from(block.buf, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a frozen table"%block.name)
+    return size, json.loads(bytes(block.buf[HEADER.size:HEADER.size + size]).decode('utf-8'))
+
+#
+# Opens an existing shared memory block, leaving it to the owner's resource
+# tracker only (the tracker unlinks the blocks registered with it when the
+# processes using it are gone, although the block belongs to the process
+# that froze the table)
+#
+# Before Python 3.13 attaching always registers the block. A process sharing
+# the owner's tracker (its children, or the owner itself) registers it again
+# to no effect, and must not unregister it: that would remove the owner's
+# registration. A process with a tracker of its own unregisters it.
+#
+def _open_block(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    block = shared_memory.SharedMemory(name)
+    try:
+        size, header = _read_header(block)
+    except ValueError:
+        block.close()
+        raise
+    if header.get('tracker') != _tracker():
+        resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+#
+# Offsets of the cell presence flags and of the cell values of a block
+# with a header of the given length
+#
+def _layout(header_size, cells):
+    flags = HEADER.size + header_size
+    values = (flags + cells + 7)//8*8
+    return flags, values
+
+#
+# A read-only snapshot of a Table living in a single shared memory block:
+#
+#   magic and header length, JSON header (cell type, labels, unit, string
+#   width and the owner's resource tracker), one presence byte per cell, then the cell values row by row
+#   (doubles, 64-bit integers or fixed width UTF-8 strings)
+#
+# Other processes attach to it by name (the handle) without copying or
+# unpickling the cells; pickling a snapshot only sends its name. The block
+# is never written after creation, so lookups from many threads need no lock.
+#
+class FrozenTable:
+    def __init__(self, block, owner=False):
+        self.block = block
+        self.owner = owner
+        buf = block.buf
+        size, header = _read_header(block)
+        self.celltype = CELLTYPES[header['celltype']]
+        self.xlabels = tuple(header['xlabels'])
+        self.ylabels = tuple(header['ylabels'])
+        self.unit = header['unit']
+        self.width = header['width']
+        self._x = { x:i for i, x in enumerate(self.xlabels) }
+        self._y = { y:i for i, y in enumerate(self.ylabels) }
+
+        cells = len(self.xlabels)*len(self.ylabels)
+        flags, values = _layout(size, cells)
+        self._present = buf[flags:flags + cells]
+        if self.celltype is str:
+            self._values = buf[values:values + cells*self.width]
+        else:
+            code, itemsize = ARRAY_TYPE[header['celltype']]
+            self._values = buf[values:values + cells*itemsize].cast(code)
+
+    #
+    # Copies a Table into a new shared memory block
+    #
+    @classmethod
+    def create(cls, table, name=None):
+        celltype = table.celltype.__name__
+        if celltype not in CELLTYPES:
+            raise TypeError("cannot freeze a table of %s"%celltype)
+        cells = [ table.tabledict[y][x] for y in table.ylabels for x in table.xlabels ]
+        width = 0
+        if table.celltype is str:
+            cells = [ None if v is None else v.encode('utf-8') for v in cells ]
+            width = max([ len(v) for v in cells if v is not None ] + [1])
+        header = json.dumps({ 'celltype' : celltype, 'xlabels' : list(table.xlabels),
+            'ylabels' : list(table.ylabels), 'unit' : table.unit,
+            'width' : width, 'tracker' : _tracker() }).encode('utf-8')
+        flags, values = _layout(len(header), len(cells))
+        itemsize = width if table.celltype is str else ARRAY_TYPE[celltype][1]
+
+        block = shared_memory.SharedMemory(name, create=True,
+            size=max(1, values + len(cells)*itemsize))
+        buf = block.buf
+        HEADER.pack_into(buf, 0, MAGIC, len(header))
+        buf[HEADER.size:flags] = header
+        for i, value in enumerate(cells):
+            if value is None:
+                continue
+            buf[flags + i] = 1
+            start = values + i*itemsize
+            if table.celltype is str:
+                buf[start:start + len(value)] = value
+            else:
+                struct.pack_into(ARRAY_TYPE[celltype][0], buf, start, value)
+        return cls(block, owner=True)
+
+    #
+    # Attaches to the snapshot with the given handle
+    #
+    @classmethod
+    def attach(cls, handle):
+        return cls(_open_block(handle))
+
+    # name of the shared memory block, passed to attach() by other processes
+    @property
+    def handle(self):
+        return self.block.name
+
+    def __reduce__(self):
+        return (FrozenTable.attach, (self.handle,))
+
+    def _validate_key(self, key):
+        if not isinstance(key, Sized):
+            raise TypeError("key must be a sized container")
+        if len(key) != 2:
+            raise KeyError("key must have exactly two elements")
+        row, col = key
+        if row not in self._y:
+            raise KeyError("%s is not a valid y-label"%str(row))
+        if col not in self._x:
+            raise KeyError("%s is not a valid x-label"%str(col))
+        return self._y[row]*len(self.xlabels) + self._x[col]
+
+    def __getitem__(self, key):
+        i = self._validate_key(key)
+        if not self._present[i]:
+            return None
+        if self.celltype is str:
+            w = self.width
+            return bytes(self._values[i*w:(i+1)*w]).rstrip(b'\0').decode('utf-8')
+        return self._values[i]
+
+    def __setitem__(self, key, value):
+        raise TypeError("a frozen table cannot be changed")
+
+    def __delitem__(self, key):
+        raise TypeError("a frozen table cannot be changed")
+
+    # same as Table.to_dict()
+    def to_dict(self):
+        return {
+            'celltype' : self.celltype.__name__,
+            'xlabels' : list(self.xlabels),
+            'ylabels' : list(self.ylabels),
+            'unit' : self.unit,
+            'cells' : [ [ self[y,x] for x in self.xlabels ] for y in self.ylabels ],
+        }
+
+    # a mutable copy of the snapshot
+    def thaw(self):
+        return Table.from_dict(self.to_dict())
+
+    #
+    # Detaches from the block; the owner (the process that froze the table)
+    # also frees it, so attach it elsewhere only while the owner keeps it
+    #
+    def close(self):
+        block = self._detach()
+        if block is not None and self.owner:
+            block.unlink()
+
+    # release the views and the mapping of the block (without unlinking it,
+    # which only close() does)
+    def _detach(self):
+        block = self.block
+        if block is None:
+            return None
+        self.block = None
+        self._present.release()
+        self._values.release()
+        block.close()
+        return block
+
+    def __del__(self):
+        if getattr(self, 'block', None) is not None:
+            self._detach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# a child reading a snapshot attached by handle
+def _read_snapshot(handle, results):
+    snapshot = FrozenTable.attach(handle)
+    results.put(snapshot['y','x'])
+    snapshot.close()
+
+#
+# Freezes a table and attaches to it from fork and spawn children, from an
+# unrelated process and through pickle in the same process, then closes it
+# (or exits without closing when crash is set) and prints the handle
+#
+def _share(crash=False):
+    import multiprocessing
+    import pickle
+    import subprocess
+    import sys
+    table = Table(float, ['x'], ['y'])
+    table['y','x'] = 1.5
+    frozen = table.freeze()
+    methods = [ m for m in ('fork', 'spawn') if m in multiprocessing.get_all_start_methods() ]
+    for method in methods:
+        context = multiprocessing.get_context(method)
+        results = context.Queue()
+        child = context.Process(target=_read_snapshot, args=(frozen.handle, results))
+        child.start()
+        assert results.get(timeout=60) == 1.5
+        child.join()
+    # a process with a resource tracker of its own
+    subprocess.run([sys.executable, '-c', "import table; t = table.FrozenTable.attach(%r); "
+        "assert t['y','x'] == 1.5; t.close()"%frozen.handle],
+        check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    copy = pickle.loads(pickle.dumps(frozen))
+    assert copy['y','x'] == 1.5
+    copy.close()
+    # the owner's block outlived every process that attached
+    assert frozen['y','x'] == 1.5
+    print(frozen.handle)
+    sys.stdout.flush()
+    if crash:
+        os._exit(1)
+    frozen.close()
+
+#
+# Checks that the snapshots attached by other processes belong to the owner
+# only: closing the owner reports no resource tracker error and frees the
+# block, and an owner exiting without closing it still has it freed
+#
+def check_sharing():
+    import subprocess
+    import sys
+    import time
+    for crash in (False, True):
+        run = subprocess.run([sys.executable, os.path.abspath(__file__), 'share']
+            + (['crash'] if crash else []), capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        if run.returncode != (1 if crash else 0) or 'Traceback' in run.stderr:
+            raise AssertionError("sharing a snapshot failed:\n" + run.stderr)
+        if not crash and run.stderr:
+            raise AssertionError("closing the owner reported:\n" + run.stderr)
+        handle = run.stdout.split()[-1]
+        # the tracker frees the block of a crashed owner once it exits
+        deadline = time.time() + 10
+        while True:
+            try:
+                block = shared_memory.SharedMemory(handle)
+            except FileNotFoundError:
+                break
+            block.close()
+            if time.time() > deadline:
+                raise AssertionError("%s was not freed"%handle)
+            time.sleep(0.1)
+    print("snapshots attached from fork, spawn, other processes and pickle: owner closes cleanly")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'share':
+        _share(crash='crash' in sys.argv)
+    else:
+        check_sharing()
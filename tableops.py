@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+#
+# tableops.py
+#
+# Elementwise operations over whole tables: operands are aligned on their
+# shared labels, cells without a value are masked out, and the result is
+# written in one pass instead of cell by cell through Table.__getitem__
+#
+# A cell without a value is None, or NaN in the array grids of a compiled
+# backend (see kernels.py); both read as None.
+#
+# An operand is a Table, a grid view (integer codes as labels), a projection
+# of another operand onto other labels, a mask or a constant. Every operand
+# gives its labels (None for any label) and its rows by label.
+#
+
+from table import Table
+
+#
+# A grid indexed by [player code][dealer code] (see easybj.make_grid()) with
+# the given codes as labels (None for all the codes)
+#
+class GridView:
+    def __init__(self, grid, ylabels=None, xlabels=None):
+        self.grid = grid
+        self.ylabels = ylabels
+        self.xlabels = xlabels
+
+    def row(self, y):
+        return GridRow(self.grid[y])
+
+# a row of a grid whose NaN cells read as None
+class GridRow:
+    def __init__(self, row):
+        self._row = row
+
+    def __getitem__(self, x):
+        value = self._row[x]
+        return None if value != value else value
+
+    def __setitem__(self, x, value):
+        self._row[x] = value
+
+#
+# Reads an operand through other y-labels: view[y, x] is operand[mapping[y],
+# x] (e.g. project(stand, {'88':'16'}) reads the pair 88 as hard 16). Labels
+# missing from the mapping read through unchanged.
+#
+class Projection:
+    def __init__(self, operand, mapping, ylabels=None):
+        self.operand = operand
+        self.mapping = mapping
+        if ylabels is None and operand.ylabels is not None:
+            ylabels = list(operand.ylabels) + [ y for y in mapping if y not in operand.ylabels ]
+        self.ylabels = ylabels
+        self.xlabels = operand.xlabels
+
+    def row(self, y):
+        return row_of(self.operand, self.mapping.get(y, y))
+
+# a projection of an operand onto other y-labels
+def project(operand, mapping, ylabels=None):
+    return Projection(operand, mapping, ylabels)
+
+# a row of a single value
+class ConstantRow:
+    def __init__(self, value):
+        self.value = value
+
+    def __getitem__(self, x):
+        return self.value
+
+#
+# The same value in every cell, for any labels
+#
+class Constant:
+    ylabels = None
+    xlabels = None
+
+    def __init__(self, value):
+        self._row = ConstantRow(value)
+
+    def row(self, y):
+        return self._row
+
+# a row whose cells failing keep(value) read as None
+class MaskedRow:
+    def __init__(self, row, keep):
+        self._row = row
+        self.keep = keep
+
+    def __getitem__(self, x):
+        value = self._row[x]
+        return value if value is not None and self.keep(value) else None
+
+#
+# Reads an operand with the cells failing keep(value) masked out
+#
+class Mask:
+    def __init__(self, operand, keep):
+        self.operand = operand
+        self.keep = keep
+        self.ylabels = operand.ylabels
+        self.xlabels = operand.xlabels
+
+    def row(self, y):
+        return MaskedRow(row_of(self.operand, y), self.keep)
+
+# an operand with the cells failing keep(value) masked out
+def mask(operand, keep):
+    return Mask(operand, keep)
+
+#
+# Reads an operand with every row outside ylabels masked out (unlike the
+# labels of an operand, the selection does not restrict the alignment)
+#
+class Selection:
+    def __init__(self, operand, ylabels):
+        self.operand = operand
+        self.selected = set(ylabels)
+        self.ylabels = operand.ylabels
+        self.xlabels = operand.xlabels
+
+    def row(self, y):
+        if y in self.selected:
+            return row_of(self.operand, y)
+        return ConstantRow(None)
+
+# an operand with the rows outside ylabels masked out
+def select(operand, ylabels):
+    return Selection(operand, ylabels)
+
+# the row of an operand, read (and written) by x-label
+def row_of(operand, y):
+    if isinstance(operand, Table):
+        return operand.tabledict[y]
+    return operand.row(y)
+
+# operands that are plain values become constants
+def operand(value):
+    if value is None or isinstance(value, (int, float, str)):
+        return Constant(value)
+    return value
+
+#
+# Returns the (ylabels, xlabels) shared by all the operands, in the order of
+# the first operand that has labels
+#
+def align(*operands):
+    labels = []
+    for axis in ('ylabels', 'xlabels'):
+        shared = None
+        for op in operands:
+            op_labels = getattr(op, axis)
+            if op_labels is None:
+                continue
+            if shared is None:
+                shared = list(op_labels)
+            else:
+                present = set(op_labels)
+                shared = [ label for label in shared if label in present ]
+        if shared is None:
+            raise ValueError("no operand has %s"%axis)
+        labels.append(shared)
+    return tuple(labels)
+
+#
+# Applies func to the cells of the operands aligned on their shared labels
+# and returns the result (in out when given, else in a new Table of the
+# given cell type). Cells where func returns None are left untouched.
+#
+def apply(func, operands, out=None, celltype=float):
+    operands = [ operand(op) for op in operands ]
+    if out is None:
+        ylabels, xlabels = align(*operands)
+        out = Table(celltype, xlabels, ylabels)
+    else:
+        ylabels, xlabels = align(out, *operands)
+    for y in ylabels:
+        rows = [ row_of(op, y) for op in operands ]
+        out_row = row_of(out, y)
+        for x in xlabels:
+            value = func(*[ row[x] for row in rows ])
+            if value is not None:
+                out_row[x] = value
+    return out
+
+# largest of values, ignoring None (the first one wins a tie, like max())
+def _maximum(*values):
+    best = None
+    for value in values:
+        if value is not None and (best is None or value > best):
+            best = value
+    return best
+
+#
+# Elementwise maximum of the operands (cells without a value are masked out;
+# a cell is left unset when no operand has a value)
+#
+def maximum(*operands, out=None):
+    return apply(_maximum, operands, out)
+
+#
+# Elementwise name of the largest operand. Values within tol of the largest
+# are tied, and a tie goes to the earliest operand (tie='first') or to the
+# latest (tie='last'), so the result never depends on float equality checks.
+#
+def argmax(operands, names, out=None, tie='first', tol=0.):
+    if len(operands) != len(names):
+        raise ValueError("need one name per operand")
+    if tie not in ('first', 'last'):
+        raise ValueError("unknown tie rule %s"%tie)
+    order = list(range(len(names)))
+    if tie == 'last':
+        order.reverse()
+    def best(*values):
+        top = _maximum(*values)
+        if top is None:
+            return None
+        for i in order:
+            if values[i] is not None and values[i] >= top - tol:
+                return names[i]
+    return apply(best, operands, out, str)
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+#
+# telemetry.py
+#
+# Observer hooks reporting per-stage timings, cells written, cache hits and
+# misses and peak memory of each calculation, plus exporters for Prometheus
+# textfiles and JSON lines
+#
+
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# registered observers (callables receiving one event dictionary)
+_observers = []
+
+#
+# Registers an observer until close() is called or the with block ends
+#
+# Every event is a dictionary with an 'event' key: 'stage' events carry the
+# stage name, seconds, cells and peak_memory_kb; the final 'calculate' event
+# carries the totals plus cache_hits and cache_misses.
+#
+class instrument:
+    def __init__(self, callback):
+        self.callback = callback
+        _observers.append(callback)
+
+    def close(self):
+        if self.callback in _observers:
+            _observers.remove(self.callback)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# peak resident memory of this process in KB (None when unavailable)
+def peak_memory_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# number of cells set in grids indexed by [player code][dealer code] (empty
+# cells are None, or NaN in the arrays of a compiled backend)
+def count_cells(grids):
+    return sum(v is not None and not (isinstance(v, float) and v != v)
+        for grid in grids for row in grid for v in row)
+
+#
+# Recorder used when no observer is registered: runs stages untouched
+#
+class NullRecorder:
+    def stage(self, name, func, *grids):
+        return func()
+
+    def finish(self, calc):
+        pass
+
+NULL = NullRecorder()
+
+#
+# Recorder reporting to a snapshot of the registered observers
+#
+class Recorder:
+    def __init__(self, observers):
+        self.observers = observers
+        self.start = time.perf_counter()
+        self.cells = 0
+
+    def emit(self, event):
+        for observer in self.observers:
+            observer(event)
+
+    # run a stage and report it; grids are the grids the stage fills in
+    def stage(self, name, func, *grids):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        cells = count_cells(grids)
+        self.cells += cells
+        self.emit({ 'event' : 'stage', 'stage' : name, 'seconds' : seconds,
+            'cells' : cells, 'peak_memory_kb' : peak_memory_kb() })
+        return result
+
+    # report the whole calculation
+    def finish(self, calc):
+        self.emit({ 'event' : 'calculate',
+            'seconds' : time.perf_counter() - self.start, 'cells' : self.cells,
+            'cache_hits' : calc.cache_hits, 'cache_misses' : calc.cache_misses,
+            'peak_memory_kb' : peak_memory_kb() })
+
+#
+# Returns the recorder of one calculation. Observers are resolved once here,
+# so a calculation without observers only pays for NullRecorder calls.
+#
+def recorder():
+    if not _observers:
+        return NULL
+    return Recorder(list(_observers))
+
+#
+# Observer appending every event as one JSON line
+#
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, event):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(dict(event, time=time.time())) + "\n")
+
+#
+# Observer rewriting a Prometheus textfile-collector file after each
+# calculation (written to a temporary file and renamed, so the collector
+# never reads a partial file)
+#
+class PrometheusExporter:
+    def __init__(self, path, prefix="easybj"):
+        self.path = path
+        self.prefix = prefix
+        self.stages = {}
+        self.calculations = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last = {}
+
+    def __call__(self, event):
+        if event['event'] == 'stage':
+            self.stages[event['stage']] = event
+        elif event['event'] == 'calculate':
+            self.calculations += 1
+            self.cache_hits += event['cache_hits']
+            self.cache_misses += event['cache_misses']
+            self.last = event
+            self.write()
+
+    # text of all the metrics in exposition format
+    def text(self):
+        p = self.prefix
+        lines = []
+        def metric(name, kind, helptext, samples):
+            lines.append("# HELP %s_%s %s"%(p, name, helptext))
+            lines.append("# TYPE %s_%s %s"%(p, name, kind))
+            for labels, value in samples:
+                lines.append("%s_%s%s %s"%(p, name, labels, repr(float(value))))
+
+        metric("stage_seconds", "gauge", "Duration of the last run of each stage.",
+            [ ('{stage="%s"}'%s, e['seconds']) for s, e in sorted(self.stages.items()) ])
+        metric("stage_cells", "gauge", "Cells written by the last run of each stage.",
+            [ ('{stage="%s"}'%s, e['cells']) for s, e in sorted(self.stages.items()) ])
+        metric("calculate_seconds", "gauge", "Duration of the last calculation.",
+            [ ('', self.last.get('seconds', 0.)) ])
+        metric("calculations_total", "counter", "Number of calculations.",
+            [ ('', self.calculations) ])
+        metric("cache_hits_total", "counter", "Cache hits across calculations.",
+            [ ('', self.cache_hits) ])
+        metric("cache_misses_total", "counter", "Cache misses across calculations.",
+            [ ('', self.cache_misses) ])
+        if self.last.get('peak_memory_kb') is not None:
+            metric("peak_memory_bytes", "gauge", "Peak resident memory of the process.",
+                [ ('', self.last['peak_memory_kb']*1024) ])
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        tmp = "%s.%d.tmp"%(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.text())
+        os.replace(tmp, self.path)
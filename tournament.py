@@ -0,0 +1,436 @@
+#!/usr/bin/python3
+#
+# tournament.py
+#
+# Optimal betting and play for the last rounds of a blackjack tournament:
+# the aim is finishing ahead of every opponent (and at or above a target),
+# not the largest EV
+#
+# A dynamic program over (rounds left, bankroll bucket) chooses the bet of
+# each round and the first action of each initial hand. The opponents bet a
+# fixed amount and play the EV strategy, so given their current bankrolls
+# their final bankroll distributions do not depend on the player's choices:
+# they only enter through the probability of beating all of them with each
+# final bankroll. Re-solving from the positions observed before every round
+# gives a policy that reacts to the opponents.
+#
+# Bankrolls are counted in buckets of half a chip, so that the half-unit
+# results (surrender, a 3:2 blackjack) of bets of whole chips land exactly
+# on a bucket. A result between two buckets (a 6:5 blackjack on an odd
+# number of chips) is paid down to the bucket below, as at a table without
+# smaller chips.
+#
+# A round can lose more than the bet (doubling, splitting), and a bankroll
+# has to cover the worst loss of an action to take it: a bet is open to the
+# bankrolls that cover it, and its actions losing more than the bankroll
+# are left out. Playing the EV strategy, a hand whose best action is not
+# covered takes the best one by EV that is.
+#
+# Every layer of the program is computed for all the buckets at once, one
+# shifted copy of the next layer per distinct result, and memory stays in
+# O(rounds * buckets).
+#
+
+import math
+import time
+from bisect import bisect_right
+from multiprocessing import Pool
+
+import codes
+import easybj
+from easybj import DEALER_CODE, INITIAL_CODE, make_rules
+from outcome import OutcomeModel, accumulate
+from table import Table
+
+#
+# Returns the values of a layer from bucket start on, shifted by s buckets
+# (bankrolls leaving the grid are clamped to its ends)
+#
+def shifted(values, s, start=0):
+    size = len(values)
+    lo, hi = start + s, size + s
+    out = values[min(max(lo, 0), size):max(min(hi, size), 0)]
+    if lo < 0:
+        out = [values[0]]*min(-lo, size - start) + out
+    if hi > size:
+        out += [values[-1]]*min(hi - size, size - start)
+    return out
+
+# value of an action the bankroll does not cover
+NOT_COVERED = float('-inf')
+
+#
+# Returns the win probability of each bucket from start on with one more
+# round to play before the layer values, for bucketed cells (see
+# TournamentSolver.shifts()): each cell takes, among the actions whose worst
+# loss the bucket covers, the one with the best expected next value, or the
+# first one for cells in order of preference
+#
+# task: (cells, values, start)
+#
+def expectation(task):
+    cells, values, start = task
+    cache = {}
+    def layer(s):
+        if s not in cache:
+            cache[s] = shifted(values, s, start)
+        return cache[s]
+    n = len(values) - start
+    total = [0.]*n
+    for ordered, actions in cells:
+        best = None
+        for dist in actions:
+            (s, p), rest = dist[0], dist[1:]
+            out = [ p*v for v in layer(s) ]
+            for s, p in rest:
+                out = [ o + p*v for o, v in zip(out, layer(s)) ]
+            # buckets below the worst loss (the first shift) cannot take it
+            low = min(max(-dist[0][0] - start, 0), n)
+            out[:low] = [NOT_COVERED]*low
+            if best is None:
+                best = out
+            elif ordered:
+                best = [ o if b == NOT_COVERED else b for b, o in zip(best, out) ]
+            else:
+                best = list(map(max, best, out))
+        total = [ t + b for t, b in zip(total, best) ]
+    return total
+
+#
+# Returns the shift in buckets of a result of x units of a bet of b buckets,
+# paid down to a whole bucket
+#
+def shift(b, x):
+    return int(math.floor(b*x + 1e-9))
+
+# the worst loss of a net distribution in bets
+def worst_loss(dist):
+    return max(0., -min(x for x, p in dist.items() if p > 0.))
+
+# the mean of a net distribution
+def mean(dist):
+    return sum(x*p for x, p in dist.items())
+
+#
+# Returns whether bucketed distribution a is at least as likely as b to land
+# at or above every shift (first order stochastic dominance)
+#
+def dominates(a, b):
+    tails = {}
+    tail = 0.
+    for s, p in reversed(a):
+        tail += p
+        tails[s] = tail
+    tail = 0.
+    for s, p in reversed(b):
+        tail += p
+        # a's mass at or above s
+        above = max([ t for x, t in tails.items() if x >= s ], default=0.)
+        if above < tail*(1 - 1e-12):
+            return False
+    return True
+
+#
+# Returns the bucketed distributions of the actions of a cell without those
+# another one dominates (the win probability never decreases with the
+# bankroll, so a dominated action is never strictly better)
+#
+def undominated(actions):
+    kept = []
+    for i, a in enumerate(actions):
+        if not any(dominates(b, a) and (not dominates(a, b) or j < i)
+                for j, b in enumerate(actions) if j != i):
+            kept.append(a)
+    return kept
+
+#
+# Returns the final bankroll distribution (a list by bucket) of a player
+# starting from bucket start who bets the given number of buckets (all the
+# whole chips left when less) for a number of rounds, or sits out below
+# min_bucket
+#
+# round_dist: the net distribution of a round given the largest loss the
+#   bankroll covers, in bets
+#
+def evolve(start, bet, rounds, round_dist, size, min_bucket):
+    result = [0.]*size
+    result[start] = 1.
+    for _ in range(rounds):
+        new = [0.]*size
+        for m, q in enumerate(result):
+            if q == 0.:
+                continue
+            if m < min_bucket:
+                new[m] += q
+                continue
+            b = min(bet, m - m % 2)
+            for x, p in round_dist(m/b).items():
+                new[min(max(m + shift(b, x), 0), size - 1)] += q*p
+        result = new
+    return result
+
+#
+# Solves tournament endgames from the per-initial-hand outcome distributions
+# of the calculated results. Amounts are in the same unit as the chip, and
+# bets are whole chips.
+#
+# results: output of easybj.calculate() (calculated when omitted)
+# rules: the rules the results are calculated with
+#
+class TournamentSolver:
+    def __init__(self, results=None, rules=None, min_bet=10, max_bet=100, chip=10, bet_step=None):
+        bet_step = bet_step or chip
+        if min_bet % chip or bet_step % chip:
+            raise ValueError("bets must be multiples of the chip")
+        self.rules = make_rules(rules)
+        if results is None:
+            results = easybj.calculate(rules=rules)
+        self.model = OutcomeModel(results, rules)
+        self.chip = chip
+        self.min_bet = min_bet
+        self.bets = [min_bet] + list(range((min_bet//bet_step + 1)*bet_step, max_bet + 1, bet_step))
+        self.cells = self.make_cells()
+        # worst losses of the actions of the cells, in bets
+        self.losses = sorted({ worst_loss(dist) for pc, dc, p, actions in self.cells
+            for action, dist in actions })
+        # cells in buckets by (bet, whether only the EV strategy is played)
+        self._shifts = {}
+        # rounds of the EV strategy by largest loss covered
+        self._ev_rounds = {}
+
+    # bucket of an amount (whole half chips)
+    def bucket(self, amount):
+        return int(amount*2//self.chip)
+
+    #
+    # Returns [(player label, dealer label, probability, [(action, net
+    # distribution)])] of the initial cells, the EV strategy's action first
+    #
+    def make_cells(self):
+        initprob = self.model.results['initial']
+        strategy = self.model.results['strategy']
+        cells = []
+        for dc in DEALER_CODE + ['BJ']:
+            for pc in INITIAL_CODE:
+                p = initprob[pc,dc]
+                if p <= 0.:
+                    continue
+                if pc == 'BJ':
+                    actions = [ (None, { 0. if dc == 'BJ' else self.model.blackjack: 1. }) ]
+                elif dc == 'BJ':
+                    actions = [ (None, { -1.: 1. }) ]
+                else:
+                    best = strategy[pc,dc]
+                    actions = [ (best, self.model.cell_distribution(pc, dc)) ]
+                    for action in self.legal_actions(pc):
+                        if action != best[0]:
+                            actions.append((action, self.model.cell_distribution(pc, dc, action)))
+                cells.append((pc, dc, p, actions))
+        return cells
+
+    # the actions of a cell by preference when playing the EV strategy: the
+    # strategy's, then the others by EV
+    def ev_order(self, actions):
+        return actions[:1] + sorted(actions[1:], key=lambda a: mean(a[1]), reverse=True)
+
+    #
+    # Returns the net distribution of a round of the EV strategy when the
+    # bankroll covers losses of at most max_loss bets
+    #
+    def ev_round(self, max_loss):
+        # the losses covered only change at the worst loss of an action
+        i = bisect_right(self.losses, max_loss + 1e-9)
+        if i not in self._ev_rounds:
+            covered = self.losses[:i]
+            result = {}
+            for pc, dc, p, actions in self.cells:
+                for action, dist in self.ev_order(actions):
+                    if worst_loss(dist) in covered:
+                        accumulate(result, dist, p)
+                        break
+            self._ev_rounds[i] = result
+        return self._ev_rounds[i]
+
+    # first actions the rules allow on an initial hand
+    def legal_actions(self, pc):
+        code = codes.CODE[pc]
+        pair = codes.is_pair(code)
+        total = codes.hand(codes.points(code)) if pair and not codes.is_soft(code) else code
+        actions = ['S', 'H']
+        if total in self.model.doubles:
+            actions.append('D')
+        if self.rules['surrender']:
+            actions.append('R')
+        if pair and self.rules['split_hands'] > 1:
+            actions.append('P')
+        return actions
+
+    #
+    # Returns the cells as (ordered, [[(shift, weighted probability)] per
+    # action]) for a bet in buckets, merging results that land in the same
+    # bucket and every cell with a single action (or, playing the EV
+    # strategy, whose action loses at most the bet) into one. The actions of
+    # ordered cells are by preference, the others are all candidates.
+    #
+    def shifts(self, bet, ev_play=False):
+        key = (bet, ev_play)
+        if key not in self._shifts:
+            fixed = {}
+            cells = []
+            for pc, dc, p, actions in self.cells:
+                if len(actions) == 1 or ev_play and worst_loss(actions[0][1]) <= 1.:
+                    accumulate(fixed, actions[0][1], p)
+                elif ev_play:
+                    cells.append((True, [ self.bucketed(dist, bet, p)
+                        for action, dist in self.ev_order(actions) ]))
+                else:
+                    # an action dominating another never loses more
+                    cells.append((False, undominated([ self.bucketed(dist, bet, p)
+                        for action, dist in actions ])))
+            cells.append((False, [ self.bucketed(fixed, bet) ]))
+            self._shifts[key] = cells
+        return self._shifts[key]
+
+    # a net distribution as [(shift in buckets, weight * probability)] for a
+    # bet in buckets
+    def bucketed(self, dist, bet, weight=1.):
+        result = {}
+        for x, p in dist.items():
+            if p > 0.:
+                s = shift(bet, x)
+                result[s] = result.get(s, 0.) + weight*p
+        return sorted(result.items())
+
+    #
+    # Solves the endgame and returns a dictionary of:
+    #
+    #   win_probability: probability of winning from the starting bankroll
+    #   bet: best bet of the first round
+    #   values: values[r][m] is the win probability with r rounds left and
+    #     m half chips
+    #   bets: bets[r][m] is the best bet with r rounds left and m half chips
+    #     (0 when below the minimum bet)
+    #
+    # bankroll: the player's bankroll
+    # rounds: rounds left to play
+    # opponents: [(bankroll, bet)] of each opponent
+    # target: final bankroll the player needs at least
+    # cap: largest bankroll tracked (larger ones count as the cap); by
+    #   default twice the largest bet per round above the largest bankroll
+    # flat: bet the minimum and play the EV strategy (for comparison)
+    # processes: size of the worker pool the bets of a round are shared
+    #   among (None for one per CPU, 0 to run inline)
+    #
+    # The state is (rounds left, bankroll) only, with no dimension for the
+    # opponents' positions: the opponents' final bankrolls are taken from
+    # their positions now, assuming they keep betting the same amount with
+    # the EV strategy. The policy therefore cannot react to how the
+    # opponents' rounds go; solving again before every round with their new
+    # positions approximates that.
+    #
+    def solve(self, bankroll, rounds, opponents=(), target=0, cap=None, flat=False,
+            processes=None):
+        bucket = self.bucket
+        if cap is None:
+            cap = max([bankroll, target] + [ b for b, _ in opponents ]) + 2*rounds*self.bets[-1]
+        size = bucket(cap) + 1
+        min_bucket = bucket(self.min_bet)
+
+        # probability of beating every opponent with each final bankroll
+        final = [ 1. if m >= bucket(target) else 0. for m in range(size) ]
+        for start, bet in opponents:
+            if bet % self.chip:
+                raise ValueError("bets must be multiples of the chip")
+            dist = evolve(bucket(start), bucket(bet), rounds, self.ev_round, size, min_bucket)
+            below = 0.
+            for m in range(size):
+                final[m] *= below
+                below += dist[m]
+
+        values = [final]
+        bets = [[0]*size]
+        choices = self.bets[:1] if flat else self.bets
+        pool = Pool(processes) if processes != 0 and len(choices) > 1 else None
+        try:
+            for r in range(1, rounds + 1):
+                prev = values[-1]
+                # a bet is only open to the bankrolls that cover it
+                starts = [ max(bucket(bet), min_bucket) for bet in choices ]
+                tasks = [ (self.shifts(bucket(bet), flat), prev, start)
+                    for bet, start in zip(choices, starts) if start < size ]
+                expected = pool.map(expectation, tasks) if pool else map(expectation, tasks)
+                layer, best_bets = list(prev), [0]*size
+                for bet, start, e in zip(choices, starts, expected):
+                    for m in range(start, size):
+                        if best_bets[m] == 0 or e[m - start] > layer[m]:
+                            layer[m], best_bets[m] = e[m - start], bet
+                values.append(layer)
+                bets.append(best_bets)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        m = min(bucket(bankroll), size - 1)
+        return {
+            'win_probability' : values[rounds][m],
+            'bet' : bets[rounds][m],
+            'values' : values,
+            'bets' : bets,
+        }
+
+    #
+    # Returns the strategy Table of the first actions that maximise the win
+    # probability with r rounds left, a bankroll and a bet, from a solution
+    # of solve() (letters as in the results of easybj.calculate())
+    #
+    def play(self, solution, rounds, bankroll, bet):
+        values = solution['values'][rounds - 1]
+        m = min(self.bucket(bankroll), len(values) - 1)
+        b = self.bucket(bet)
+        table = Table(str, DEALER_CODE, easybj.PLAYER_CODE)
+        for pc, dc, p, actions in self.cells:
+            if pc == 'BJ' or dc == 'BJ':
+                continue
+            # win probability of each first action the bankroll covers, by
+            # letter
+            scores = {}
+            best = None
+            for action, dist in actions:
+                shifts = self.bucketed(dist, b)
+                if m + shifts[0][0] < 0:
+                    continue
+                letter = action[0]
+                scores[letter] = sum(q*values[min(m + s, len(values) - 1)] for s, q in shifts)
+                if best is None or scores[letter] > scores[best]:
+                    best = letter
+            if best in ('D', 'R'):
+                # doubling and surrendering also tell the best of standing
+                # and hitting
+                best += 's' if scores['S'] >= scores['H'] else 'h'
+            table[pc,dc] = best
+        return table
+
+#
+# Prints the solution of an endgame next to flat minimum betting with the EV
+# strategy, and the first actions that differ from the EV strategy
+#
+def main():
+    solver = TournamentSolver(min_bet=20, max_bet=500, chip=20, bet_step=100)
+    bankroll, rounds = 1000, 5
+    opponents = [(1300, 100), (1150, 60)]
+    start = time.perf_counter()
+    solution = solver.solve(bankroll, rounds, opponents)
+    elapsed = time.perf_counter() - start
+    flat = solver.solve(bankroll, rounds, opponents, flat=True)
+    print("bankroll %d, %d rounds left, opponents %s"%(bankroll, rounds, opponents))
+    print("win probability %.4f betting %d (flat minimum bet with the EV strategy %.4f), %d buckets in %.2fs"%(
+        solution['win_probability'], solution['bet'], flat['win_probability'],
+        len(solution['values'][0]), elapsed))
+    table = solver.play(solution, rounds, bankroll, solution['bet'])
+    strategy = solver.model.results['strategy']
+    changes = [ "%s vs %s: %s"%(pc, dc, table[pc,dc]) for pc in table.ylabels for dc in table.xlabels
+        if table[pc,dc] is not None and table[pc,dc][0] != strategy[pc,dc][0] ]
+    print("first actions differing from the EV strategy: %s"%(", ".join(changes) or "none"))
+
+if __name__ == "__main__":
+    main()